@@ -0,0 +1,32 @@
+"""Help text for the command line interface.
+
+Kept out of bozo.cli so the strings are only loaded when help is shown.
+"""
+
+HELP = {
+    "bozo": "A double-entry accounting CLI tool",
+    "commands": "Available commands",
+    "database": "Path to the database file (default: BOZO_DB env var)",
+    "init": "Initialize the database",
+    "init.name": "Name of the database file (e.g. ledger)",
+    "init.folder": "Folder where the database is created (default: current directory)",
+    "record": "Record a journal entry",
+    "record.amount": "Transaction amount",
+    "record.description": "Entry description",
+    "record.debit": "Account to debit",
+    "record.credit": "Account to credit",
+    "list": "List journal entries",
+    "list.account": "Filter by account",
+    "summary": "Show trial balance",
+    "summary.account": "Scope trial balance to an account subtree",
+    "add-account": "Create a new account",
+    "add-account.name": "Account name (e.g. assets:bank:checking)",
+    "accounts": "List chart of accounts",
+    "accounts.type": "Filter by account type (asset, liability, income, expense, capital, drawings)",
+    "upgrade": "Upgrade a ledger written by an older release",
+    "upgrade.round": (
+        "Round amounts with fractions of a cent to the cent: half-up (halves away "
+        "from zero), half-even (halves to the even cent) or down (truncate). "
+        "Without it such amounts stop the upgrade."
+    ),
+}
@@ -1,121 +1,347 @@
 """Command line interface for bozo."""
 
 import argparse
+import atexit
+import functools
+import itertools
 import os
+import stat
 import sys
-from datetime import datetime
-from decimal import Decimal
 from pathlib import Path
+from typing import TYPE_CHECKING, Callable
 
 from bozo import __version__
-from bozo.storage import DatabaseNotInitializedError, TransactionStorage
-from bozo.transaction import JournalEntry, LineItem
 
+# The storage and model modules pull in sqlite3, decimal, datetime and the
+# dataclass machinery; they are imported inside the command handlers so
+# --help, --version and argument errors don't pay for them.
+if TYPE_CHECKING:
+    from bozo.storage import TransactionStorage
 
-def create_parser() -> argparse.ArgumentParser:
-    """Create the argument parser for the CLI."""
-    parser = argparse.ArgumentParser(
-        prog="bozo",
-        description="A double-entry accounting CLI tool",
-    )
-    parser.add_argument(
-        "-v", "--version",
-        action="version",
-        version=f"%(prog)s {__version__}",
-    )
 
-    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+def _amount(value: str):
+    """Convert a command line amount straight to Decimal, with no float step."""
+    from decimal import Decimal, InvalidOperation
+
+    try:
+        amount = Decimal(value)
+    except InvalidOperation:
+        amount = None
+    if amount is None or not amount.is_finite():
+        raise argparse.ArgumentTypeError(f"invalid amount: '{value}'")
+    return amount
 
-    # Init database command
-    init_parser = subparsers.add_parser("init", help="Initialize the database")
-    init_parser.add_argument("--name", required=True, help="Name of the database file (e.g. ledger)")
-    init_parser.add_argument("--folder", type=Path, default=Path("."), help="Folder where the database is created (default: current directory)")
 
-    # Record journal entry command
-    record_parser = subparsers.add_parser("record", help="Record a journal entry")
-    record_parser.add_argument("amount", type=float, help="Transaction amount")
-    record_parser.add_argument("description", help="Entry description")
-    record_parser.add_argument("--debit", required=True, help="Account to debit")
-    record_parser.add_argument("--credit", required=True, help="Account to credit")
-    record_parser.add_argument(
+def _add_database_argument(parser: argparse.ArgumentParser, text: dict[str, str]) -> None:
+    parser.add_argument(
         "-d", "--database",
         type=Path,
         default=None,
-        help="Path to the database file (default: BOZO_DB env var)",
+        help=text.get("database"),
     )
 
-    # List entries command
-    list_parser = subparsers.add_parser("list", help="List journal entries")
+
+def _add_init(subparsers, text: dict[str, str]) -> None:
+    init_parser = subparsers.add_parser("init", help=text.get("init"))
+    init_parser.add_argument("--name", required=True, help=text.get("init.name"))
+    init_parser.add_argument("--folder", type=Path, default=Path("."), help=text.get("init.folder"))
+
+
+def _add_record(subparsers, text: dict[str, str]) -> None:
+    record_parser = subparsers.add_parser("record", help=text.get("record"))
+    record_parser.add_argument("amount", type=_amount, help=text.get("record.amount"))
+    record_parser.add_argument("description", help=text.get("record.description"))
+    record_parser.add_argument("--debit", required=True, help=text.get("record.debit"))
+    record_parser.add_argument("--credit", required=True, help=text.get("record.credit"))
+    _add_database_argument(record_parser, text)
+
+
+def _add_list(subparsers, text: dict[str, str]) -> None:
+    list_parser = subparsers.add_parser("list", help=text.get("list"))
     list_parser.add_argument(
         "-a", "--account",
-        help="Filter by account",
-    )
-    list_parser.add_argument(
-        "-d", "--database",
-        type=Path,
-        default=None,
-        help="Path to the database file (default: BOZO_DB env var)",
+        help=text.get("list.account"),
     )
+    _add_database_argument(list_parser, text)
+
 
-    # Summary command
-    summary_parser = subparsers.add_parser("summary", help="Show trial balance")
+def _add_summary(subparsers, text: dict[str, str]) -> None:
+    summary_parser = subparsers.add_parser("summary", help=text.get("summary"))
     summary_parser.add_argument(
         "-a", "--account",
-        help="Scope trial balance to an account subtree",
-    )
-    summary_parser.add_argument(
-        "-d", "--database",
-        type=Path,
-        default=None,
-        help="Path to the database file (default: BOZO_DB env var)",
+        help=text.get("summary.account"),
     )
+    _add_database_argument(summary_parser, text)
 
-    # Add account command
-    add_account_parser = subparsers.add_parser("add-account", help="Create a new account")
-    add_account_parser.add_argument("name", help="Account name (e.g. assets:bank:checking)")
-    add_account_parser.add_argument(
-        "-d", "--database",
-        type=Path,
-        default=None,
-        help="Path to the database file (default: BOZO_DB env var)",
-    )
 
-    # Accounts command
-    accounts_parser = subparsers.add_parser("accounts", help="List chart of accounts")
+def _add_add_account(subparsers, text: dict[str, str]) -> None:
+    add_account_parser = subparsers.add_parser("add-account", help=text.get("add-account"))
+    add_account_parser.add_argument("name", help=text.get("add-account.name"))
+    _add_database_argument(add_account_parser, text)
+
+
+def _add_accounts(subparsers, text: dict[str, str]) -> None:
+    accounts_parser = subparsers.add_parser("accounts", help=text.get("accounts"))
     accounts_parser.add_argument(
         "--type",
         dest="account_type",
-        help="Filter by account type (asset, liability, income, expense, capital, drawings)",
+        help=text.get("accounts.type"),
     )
-    accounts_parser.add_argument(
-        "-d", "--database",
-        type=Path,
-        default=None,
-        help="Path to the database file (default: BOZO_DB env var)",
+    _add_database_argument(accounts_parser, text)
+
+
+# Choices for "upgrade --round", named after the decimal module's modes.
+_ROUNDING_MODES = ("half-up", "half-even", "down")
+
+
+def _add_upgrade(subparsers, text: dict[str, str]) -> None:
+    upgrade_parser = subparsers.add_parser("upgrade", help=text.get("upgrade"))
+    upgrade_parser.add_argument(
+        "--round",
+        choices=_ROUNDING_MODES,
+        help=text.get("upgrade.round"),
+    )
+    _add_database_argument(upgrade_parser, text)
+
+
+# Subparser builders in the order they appear in --help.
+_SUBPARSERS = {
+    "init": _add_init,
+    "record": _add_record,
+    "list": _add_list,
+    "summary": _add_summary,
+    "add-account": _add_add_account,
+    "accounts": _add_accounts,
+    "upgrade": _add_upgrade,
+}
+
+
+def _peek_command(argv: list[str]) -> str | None:
+    """Return the subcommand named by the first token of argv, if any.
+
+    A flag before the command (e.g. "bozo -h record") is a top-level option,
+    so that case gets the full parser.
+    """
+    if argv and argv[0] in _SUBPARSERS:
+        return argv[0]
+    return None
+
+
+def _wants_help(argv: list[str]) -> bool:
+    """Return True if argv asks for -h/--help, including abbreviations."""
+    return any(
+        arg == "-h" or (len(arg) > 2 and "--help".startswith(arg))
+        for arg in argv
+    )
+
+
+# Fast-path parsing spec mirroring the argparse subparsers above:
+# command -> (positionals, options, required option dests, defaults).
+_COMMAND_SPECS = {
+    "init": (
+        (),
+        {"--name": ("name", str), "--folder": ("folder", Path)},
+        ("name",),
+        {"name": None, "folder": Path(".")},
+    ),
+    "record": (
+        (("amount", _amount), ("description", str)),
+        {
+            "--debit": ("debit", str),
+            "--credit": ("credit", str),
+            "-d": ("database", Path),
+            "--database": ("database", Path),
+        },
+        ("debit", "credit"),
+        {"debit": None, "credit": None, "database": None},
+    ),
+    "list": (
+        (),
+        {
+            "-a": ("account", str),
+            "--account": ("account", str),
+            "-d": ("database", Path),
+            "--database": ("database", Path),
+        },
+        (),
+        {"account": None, "database": None},
+    ),
+    "summary": (
+        (),
+        {
+            "-a": ("account", str),
+            "--account": ("account", str),
+            "-d": ("database", Path),
+            "--database": ("database", Path),
+        },
+        (),
+        {"account": None, "database": None},
+    ),
+    "add-account": (
+        (("name", str),),
+        {"-d": ("database", Path), "--database": ("database", Path)},
+        (),
+        {"database": None},
+    ),
+    "accounts": (
+        (),
+        {
+            "--type": ("account_type", str),
+            "-d": ("database", Path),
+            "--database": ("database", Path),
+        },
+        (),
+        {"account_type": None, "database": None},
+    ),
+}
+
+
+def _fast_parse(argv: list[str]) -> argparse.Namespace | None:
+    """Parse a well-formed command line without building argparse parsers.
+
+    Returns None for anything outside the simple cases (help, version,
+    unknown or abbreviated flags, missing values, bad types) so the caller
+    can fall back to argparse for its full behaviour and error messages.
+    """
+    if not argv or argv[0] not in _COMMAND_SPECS:
+        return None
+    command = argv[0]
+    positionals, options, required, defaults = _COMMAND_SPECS[command]
+    values = dict(defaults)
+    tokens = []
+    i = 1
+    while i < len(argv):
+        arg = argv[i]
+        i += 1
+        if not arg.startswith("-"):
+            tokens.append(arg)
+            continue
+        flag, sep, value = arg.partition("=")
+        if flag not in options:
+            return None
+        if not sep:
+            if i >= len(argv) or argv[i].startswith("-"):
+                return None
+            value = argv[i]
+            i += 1
+        dest, convert = options[flag]
+        try:
+            values[dest] = convert(value)
+        except (ValueError, argparse.ArgumentTypeError):
+            return None
+    if len(tokens) != len(positionals):
+        return None
+    for (dest, convert), token in zip(positionals, tokens):
+        try:
+            values[dest] = convert(token)
+        except (ValueError, argparse.ArgumentTypeError):
+            return None
+    if any(values[dest] is None for dest in required):
+        return None
+    return argparse.Namespace(command=command, **values)
+
+
+@functools.lru_cache(maxsize=2 * (len(_SUBPARSERS) + 1))
+def create_parser(command: str | None = None, with_help: bool = True) -> argparse.ArgumentParser:
+    """Create the argument parser for the CLI.
+
+    When command names a known subcommand only that subparser is built,
+    which keeps startup cheap. Otherwise every subparser is registered so
+    top-level help and "invalid choice" errors list them all.
+
+    Help strings live in bozo._help and are only loaded when with_help is
+    set; parsers that will just parse arguments or report usage errors
+    skip them.
+
+    Parsers are cached, so repeated in-process calls to main() reuse them;
+    parse_args() keeps no state on the parser between calls.
+    """
+    if with_help:
+        from bozo._help import HELP as text
+    else:
+        text = {}
+
+    parser = argparse.ArgumentParser(
+        prog="bozo",
+        description=text.get("bozo"),
+    )
+    parser.add_argument(
+        "-v", "--version",
+        action="version",
+        version=f"%(prog)s {__version__}",
     )
 
+    # The metavar keeps usage lines listing every command when only one
+    # subparser is built.
+    subparsers = parser.add_subparsers(
+        dest="command",
+        metavar="{" + ",".join(_SUBPARSERS) + "}",
+        help=text.get("commands"),
+    )
+
+    if command in _SUBPARSERS:
+        _SUBPARSERS[command](subparsers, text)
+    else:
+        for add_subparser in _SUBPARSERS.values():
+            add_subparser(subparsers, text)
+
     return parser
 
 
+# Row templates for the table commands, bound once instead of re-parsing
+# the format specs of an f-string on every row.
+_LIST_ROW = "{:<6} {:<12} {:<20} {:<15} {:<15} {:>10.2f}".format
+_SUMMARY_ROW = "{:<30} {:>12.2f} {:>12.2f} {:>12.2f}".format
+_ACCOUNTS_ROW = "{:<30} {:<12}".format
+
+
+# Indentation for account tree depths; deeper paths fall back to building it.
+_INDENTS = tuple("  " * depth for depth in range(16))
+
+
+def _tree_label(account: str) -> str:
+    """Return the last segment of an account path, indented by its depth."""
+    depth = account.count(":")
+    indent = _INDENTS[depth] if depth < len(_INDENTS) else "  " * depth
+    return indent + account.rpartition(":")[2]
+
+
+# Rows buffered by streaming commands before they are written out.
+_FLUSH_LINES = 1024
+
+
+def _write_lines(lines: list[str]) -> None:
+    """Write lines to stdout in a single call instead of one print per row."""
+    lines.append("")
+    sys.stdout.write("\n".join(lines))
+
+
 def cmd_init(args) -> int:
     """Handle the init command."""
     folder = args.folder.resolve()
-    db_path = folder / f"{args.name}.bozo"
+    try:
+        folder_mode = os.stat(folder).st_mode
+    except OSError:
+        folder_mode = 0
+    if not stat.S_ISDIR(folder_mode):
+        print(f"Error: Folder '{folder}' does not exist.", file=sys.stderr)
+        return 1
 
-    if db_path.exists():
+    db_path = folder / f"{args.name}.bozo"
+    if os.path.lexists(db_path):
         print(f"Database already exists at '{db_path}'.")
         return 1
 
-    if not folder.is_dir():
-        print(f"Error: Folder '{folder}' does not exist.", file=sys.stderr)
-        return 1
+    from bozo.storage import TransactionStorage
 
-    TransactionStorage.init_database(db_path)
+    # A storage cached for a ledger that used to be here holds the old file.
+    _evict_storage(os.path.abspath(db_path))
+    TransactionStorage.init_database(db_path).close()
     print(f"Initialized database at '{db_path}'.")
     return 0
 
 
-def cmd_add_account(args, storage: TransactionStorage) -> int:
+def cmd_add_account(args, storage: "TransactionStorage") -> int:
     """Handle the add-account command."""
     try:
         storage.create_account(args.name)
@@ -126,9 +352,13 @@ def cmd_add_account(args, storage: TransactionStorage) -> int:
     return 0
 
 
-def cmd_record(args, storage: TransactionStorage) -> int:
+def cmd_record(args, storage: "TransactionStorage") -> int:
     """Handle the record command."""
-    amount = Decimal(str(args.amount))
+    from datetime import datetime
+
+    from bozo.transaction import JournalEntry, LineItem
+
+    amount = args.amount
     entry = JournalEntry(
         description=args.description,
         timestamp=datetime.now(),
@@ -146,60 +376,72 @@ def cmd_record(args, storage: TransactionStorage) -> int:
     return 0
 
 
-def cmd_list(args, storage: TransactionStorage) -> int:
+def cmd_list(args, storage: "TransactionStorage") -> int:
     """Handle the list command."""
+    from bozo.transaction import ZERO
+
     if args.account:
-        entries = storage.get_by_account(args.account)
+        entries = storage.iter_by_account(args.account)
     else:
-        entries = storage.get_all()
+        entries = storage.iter_all()
 
-    if not entries:
+    first = next(entries, None)
+    if first is None:
         print("No journal entries found.")
         return 0
 
-    print(f"{'ID':<6} {'Date':<12} {'Description':<20} {'Debit Acct':<15} {'Credit Acct':<15} {'Amount':>10}")
-    print("-" * 80)
-    for entry in entries:
-        debit_item = next((li for li in entry.line_items if li.debit is not None), None)
-        credit_item = next((li for li in entry.line_items if li.credit is not None), None)
-        amount = debit_item.debit if debit_item else Decimal("0")
+    out = [
+        f"{'ID':<6} {'Date':<12} {'Description':<20} {'Debit Acct':<15} {'Credit Acct':<15} {'Amount':>10}",
+        "-" * 80,
+    ]
+    for entry in itertools.chain((first,), entries):
+        debit_item = credit_item = None
+        for li in entry.line_items:
+            if li.debit is not None:
+                debit_item = debit_item or li
+            elif li.credit is not None:
+                credit_item = credit_item or li
+            if debit_item and credit_item:
+                break
+        amount = debit_item.debit if debit_item else ZERO
         debit_acct = debit_item.account if debit_item else ""
         credit_acct = credit_item.account if credit_item else ""
-        print(f"{entry.id:<6} {entry.timestamp.strftime('%Y-%m-%d'):<12} {entry.description:<20} {debit_acct:<15} {credit_acct:<15} {amount:>10.2f}")
+        date = entry.timestamp.date().isoformat()
+        out.append(_LIST_ROW(entry.id, date, entry.description, debit_acct, credit_acct, amount))
+        if len(out) >= _FLUSH_LINES:
+            _write_lines(out)
+            out.clear()
 
+    _write_lines(out)
     return 0
 
 
-def cmd_summary(args, storage: TransactionStorage) -> int:
+def cmd_summary(args, storage: "TransactionStorage") -> int:
     """Handle the summary command."""
     scope = getattr(args, "account", None)
-    accounts = storage.get_trial_balance(account=scope)
+    accounts, (total_debits, total_credits) = storage.get_trial_balance_with_totals(account=scope)
 
     if not accounts:
         print("No journal entries recorded yet.")
         return 0
 
-    print("=== Trial Balance ===\n")
-    print(f"{'Account':<30} {'Debits':>12} {'Credits':>12} {'Net':>12}")
-    print("-" * 68)
-
-    total_debits = Decimal("0")
-    total_credits = Decimal("0")
-    for account, data in accounts.items():
-        depth = account.count(":")
-        indent = "  " * depth
-        label = indent + account.split(":")[-1]
-        print(f"{label:<30} {data['debits']:>12.2f} {data['credits']:>12.2f} {data['net']:>12.2f}")
-        total_debits += data["debits"]
-        total_credits += data["credits"]
-
-    print("-" * 68)
-    print(f"{'TOTAL':<30} {total_debits:>12.2f} {total_credits:>12.2f} {total_debits - total_credits:>12.2f}")
-
+    out = [
+        "=== Trial Balance ===\n",
+        f"{'Account':<30} {'Debits':>12} {'Credits':>12} {'Net':>12}",
+        "-" * 68,
+    ]
+    out.extend([
+        _SUMMARY_ROW(_tree_label(account), data["debits"], data["credits"], data["net"])
+        for account, data in accounts.items()
+    ])
+    out.append("-" * 68)
+    out.append(_SUMMARY_ROW("TOTAL", total_debits, total_credits, total_debits - total_credits))
+
+    _write_lines(out)
     return 0
 
 
-def cmd_accounts(args, storage: TransactionStorage) -> int:
+def cmd_accounts(args, storage: "TransactionStorage") -> int:
     """Handle the accounts command."""
     accounts = storage.get_accounts(account_type=args.account_type)
 
@@ -207,21 +449,113 @@ def cmd_accounts(args, storage: TransactionStorage) -> int:
         print("No accounts found.")
         return 0
 
-    print(f"{'Account':<30} {'Type':<12}")
-    print("-" * 42)
+    out = [f"{'Account':<30} {'Type':<12}", "-" * 42]
     for acct in accounts:
-        depth = acct.name.count(":")
-        indent = "  " * depth
-        label = indent + acct.name.split(":")[-1]
-        print(f"{label:<30} {acct.type:<12}")
+        out.append(_ACCOUNTS_ROW(_tree_label(acct.name), acct.type))
 
+    _write_lines(out)
     return 0
 
 
+def cmd_upgrade(args, db_path: str) -> int:
+    """Handle the upgrade command.
+
+    Opening a ledger upgrades it anyway; this command exists to choose how
+    amounts with fractions of a cent are rounded on the way.
+    """
+    import decimal
+
+    from bozo.storage import StorageError, TransactionStorage
+
+    rounding = None
+    if args.round:
+        rounding = getattr(decimal, "ROUND_" + args.round.replace("-", "_").upper())
+    # The cached storage, if any, was opened before this upgrade.
+    _evict_storage(db_path)
+    try:
+        TransactionStorage(Path(db_path), rounding=rounding).close()
+    except StorageError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"Database at '{db_path}' is up to date.")
+    return 0
+
+
+@functools.lru_cache(maxsize=4)
+def _as_path(value: str) -> Path:
+    """Return a Path for value, reusing it across calls with the same string."""
+    return Path(value)
+
+
+# Handlers for the commands that operate on an existing database.
+_HANDLERS: dict[str, Callable[[argparse.Namespace, "TransactionStorage"], int]] = {
+    "add-account": cmd_add_account,
+    "record": cmd_record,
+    "list": cmd_list,
+    "summary": cmd_summary,
+    "accounts": cmd_accounts,
+}
+
+
+# Open storages by absolute path, oldest first, reused across main() calls.
+# Each is kept with the (st_dev, st_ino) of the file it opened.
+_STORAGE_CACHE_SIZE = 4
+_storages: dict[str, tuple[tuple[int, int], "TransactionStorage"]] = {}
+
+
+def _open_storage(db_path: str) -> "TransactionStorage":
+    """Open storage for an absolute database path, reusing it across main() calls.
+
+    A cached storage is only reused while the path still names the file it
+    opened; a ledger deleted or replaced since is opened afresh. The least
+    recently used storage is closed once more than _STORAGE_CACHE_SIZE are
+    open.
+    """
+    from bozo.storage import TransactionStorage
+
+    try:
+        st = os.stat(db_path)
+    except OSError:
+        _evict_storage(db_path)
+        # Raises DatabaseNotInitializedError for the missing file.
+        return TransactionStorage(Path(db_path))
+    file_id = (st.st_dev, st.st_ino)
+    cached = _storages.pop(db_path, None)
+    if cached is not None and cached[0] == file_id:
+        storage = cached[1]
+    else:
+        if cached is not None:
+            cached[1].close()
+        storage = TransactionStorage(Path(db_path))
+        if len(_storages) >= _STORAGE_CACHE_SIZE:
+            _storages.pop(next(iter(_storages)))[1].close()
+    _storages[db_path] = (file_id, storage)
+    return storage
+
+
+def _evict_storage(db_path: str) -> None:
+    """Close and forget the cached storage for db_path, if any."""
+    cached = _storages.pop(db_path, None)
+    if cached is not None:
+        cached[1].close()
+
+
+@atexit.register
+def _close_storages() -> None:
+    """Close and forget every cached storage."""
+    while _storages:
+        _storages.popitem()[1][1].close()
+
+
 def main(argv: list[str] | None = None) -> int:
     """Main entry point for the CLI."""
-    parser = create_parser()
-    args = parser.parse_args(argv)
+    if argv is None:
+        argv = sys.argv[1:]
+    args = _fast_parse(argv)
+    if args is None:
+        command = _peek_command(argv)
+        parser = create_parser(command, with_help=command is None or _wants_help(argv))
+        args = parser.parse_args(argv)
 
     if args.command is None:
         parser.print_help()
@@ -231,37 +565,24 @@ def main(argv: list[str] | None = None) -> int:
         return cmd_init(args)
 
     # Resolve database path from -d flag or BOZO_DB env var
-    db_path = args.database
+    db_path = args.database or (_as_path(env_db) if (env_db := os.environ.get("BOZO_DB")) else None)
     if db_path is None:
-        env_db = os.environ.get("BOZO_DB")
-        if env_db:
-            db_path = Path(env_db)
-        else:
-            print("Error: No database specified. Use -d or set BOZO_DB environment variable.", file=sys.stderr)
-            return 1
-
-    try:
-        storage = TransactionStorage(db_path)
-    except DatabaseNotInitializedError as e:
-        print(f"Error: {e}", file=sys.stderr)
+        print("Error: No database specified. Use -d or set BOZO_DB environment variable.", file=sys.stderr)
         return 1
 
-    if args.command == "add-account":
-        return cmd_add_account(args, storage)
-
-    if args.command == "record":
-        return cmd_record(args, storage)
+    if args.command == "upgrade":
+        return cmd_upgrade(args, os.path.abspath(db_path))
 
-    if args.command == "list":
-        return cmd_list(args, storage)
+    from bozo.storage import StorageError
 
-    if args.command == "summary":
-        return cmd_summary(args, storage)
-
-    if args.command == "accounts":
-        return cmd_accounts(args, storage)
+    try:
+        storage = _open_storage(os.path.abspath(db_path))
+    except StorageError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
 
-    return 0
+    handler = _HANDLERS.get(args.command)
+    return handler(args, storage) if handler else 0
 
 
 if __name__ == "__main__":
@@ -1,100 +1,571 @@
 """SQLite storage for double-entry journal entries."""
 
+import functools
+import queue
 import sqlite3
-from datetime import datetime
+import sys
+import threading
+from bisect import bisect_left
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
+from urllib.parse import quote
 
 from bozo.transaction import Account, JournalEntry, LineItem, parse_account_path
 
 
-class DatabaseNotInitializedError(Exception):
+# Applied to every connection. synchronous=NORMAL only syncs the WAL at
+# checkpoints, which is safe against application crashes; the rest trade
+# memory for fewer reads.
+_CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -64000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",
+)
+
+
+# Idle read connections kept per storage. Extra readers opened under heavier
+# concurrency are closed when returned to a full pool.
+_READER_POOL_SIZE = 4
+
+
+# Seconds a connection waits on another process's lock before giving up
+# with "database is locked".
+_BUSY_TIMEOUT = 10.0
+
+
+# Stored in PRAGMA user_version by _init_db(). Databases from before it was
+# set read 0 and are upgraded by _upgrade_from_v0() when opened.
+_SCHEMA_VERSION = 1
+
+# Triggers the upgrade drops so the old tables can be copied and removed.
+_V0_TRIGGERS = (
+    "prevent_journal_entry_update",
+    "prevent_journal_entry_delete",
+    "prevent_line_item_update",
+    "prevent_line_item_delete",
+)
+
+
+# Rebuilt by add_many() when a bulk load defers it.
+_ACCOUNT_INDEX = """
+    CREATE INDEX IF NOT EXISTS idx_line_items_account
+    ON line_items(account)
+"""
+
+
+# Journal entries joined to their line items, one row per line item. Callers
+# append a WHERE clause and an ORDER BY that keeps each entry's rows together.
+_ENTRY_QUERY = """
+    SELECT
+        je.id, je.description, je.timestamp,
+        li.id AS line_item_id, li.account, li.debit_cents, li.credit_cents
+    FROM journal_entries je
+    LEFT JOIN line_items li ON li.journal_entry_id = je.id
+"""
+_ENTRY_BY_ID_QUERY = _ENTRY_QUERY + "WHERE je.id = ? ORDER BY li.id"
+
+
+# Entries with a line item in an account's subtree; binds _subtree(account).
+# Descendants sort between "account:" and "account;" (";" is the byte after
+# ":"), which SQLite answers with a range scan on idx_line_items_account.
+_SUBTREE_ENTRY_QUERY = _ENTRY_QUERY + """
+    WHERE je.id IN (
+        SELECT journal_entry_id FROM line_items
+        WHERE account = ? OR (account >= ? AND account < ?)
+    )
+    ORDER BY je.timestamp DESC, je.id, li.id
+"""
+
+
+# Per-account sums kept up to date by the line_items_balance trigger, so the
+# trial balance reads one row per account instead of scanning line items.
+_SUBTREE_SCOPE = "WHERE account = ? OR (account >= ? AND account < ?)"
+_BALANCE_TEMPLATE = """
+    SELECT account, debit_cents, credit_cents FROM account_balances {scope}
+    ORDER BY account
+"""
+_BALANCE_QUERY = _BALANCE_TEMPLATE.format(scope="")
+_SUBTREE_BALANCE_QUERY = _BALANCE_TEMPLATE.format(scope=_SUBTREE_SCOPE)
+
+
+# Accounts in name order, optionally of one type; the filtered form is a
+# search on idx_accounts_type_name that needs no sort.
+_ACCOUNTS_QUERY = "SELECT name, type, parent_id, id FROM accounts ORDER BY name"
+_ACCOUNTS_BY_TYPE_QUERY = (
+    "SELECT name, type, parent_id, id FROM accounts WHERE type = ? ORDER BY name"
+)
+
+
+# SQLite integers are signed 64-bit.
+_MAX_CENTS = 2**63 - 1
+
+# Message of the line_items_balance trigger's error when a running total no
+# longer fits in an integer column.
+_BALANCE_OVERFLOW = "Account balance out of range"
+
+
+# One cent, for rounding amounts with Decimal.quantize().
+_CENT = Decimal("0.01")
+
+
+def _to_cents(amount: Decimal) -> int:
+    """Convert an amount to integer cents for storage.
+
+    Raises ValueError for amounts with fractions of a cent or too large
+    to store.
+    """
+    cents = amount * 100
+    if cents != cents.to_integral_value():
+        raise ValueError(f"Amount {amount} has more than two decimal places.")
+    if abs(cents) > _MAX_CENTS:
+        raise ValueError(f"Amount {amount} is too large.")
+    return int(cents)
+
+
+# Amounts up to 10.00 are common enough to build once and share; Decimals are
+# immutable.
+_SMALL_AMOUNTS = tuple(Decimal(cents).scaleb(-2) for cents in range(1001))
+
+
+def _from_cents(cents: int) -> Decimal:
+    """Convert stored integer cents back to a Decimal amount."""
+    if 0 <= cents <= 1000:
+        return _SMALL_AMOUNTS[cents]
+    # Shifting the exponent skips the division and keeps two places.
+    return Decimal(cents).scaleb(-2)
+
+
+# Timestamps are stored as integer microseconds since this epoch. The
+# arithmetic is done on naive wall-clock times, so values round-trip exactly
+# without passing through floats or the local timezone.
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _to_micros(timestamp: datetime) -> int:
+    """Convert a timestamp to integer microseconds for storage.
+
+    Raises ValueError for timezone-aware timestamps, whose offset would be
+    lost.
+    """
+    if timestamp.tzinfo is not None:
+        raise ValueError(f"Timestamp {timestamp} is timezone-aware; use a naive local time.")
+    return (timestamp - _EPOCH) // _MICROSECOND
+
+
+def _from_micros(micros: int) -> datetime:
+    """Convert stored integer microseconds back to a timestamp."""
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+@functools.lru_cache(maxsize=4096)
+def _lower(name: str) -> str:
+    """Return name lowercased, sharing one interned string per distinct name.
+
+    Bounded like parse_account_path(), since callers pass free-form filter
+    arguments as well as stored account names.
+    """
+    return sys.intern(name.lower())
+
+
+def _subtree(account: str) -> tuple[str, str, str]:
+    """Return parameters matching account and its descendants.
+
+    See _SUBTREE_ENTRY_QUERY for how the range is searched. Names are
+    compared as plain strings, so no character in them is special.
+    """
+    return account, account + ":", account + ";"
+
+
+def _has_subtree(names: list[str], account: str) -> bool:
+    """Return whether account or any descendant of it is in sorted names."""
+    i = bisect_left(names, account)
+    if i < len(names) and names[i] == account:
+        return True
+    # Names such as "assets-old" sort between "assets" and "assets:..."
+    i = bisect_left(names, account + ":", i)
+    return i < len(names) and names[i] < account + ";"
+
+
+class StorageError(Exception):
+    """Base class for errors opening or using a ledger database."""
+    pass
+
+
+class DatabaseNotInitializedError(StorageError):
     """Raised when trying to use a database that hasn't been initialized."""
     pass
 
 
+class DatabaseOpenError(StorageError):
+    """Raised when an existing database file cannot be opened."""
+    pass
+
+
+class IncompatibleDatabaseError(StorageError):
+    """Raised when a database's schema can't be used or upgraded."""
+    pass
+
+
 class TransactionStorage:
     """SQLite-based storage for journal entries."""
 
-    def __init__(self, db_path: Path, require_init: bool = True):
-        self.db_path = Path(db_path)
-        if require_init and not self.db_path.exists():
-            raise DatabaseNotInitializedError(
-                f"Database not found at '{self.db_path}'. "
-                f"Run 'bozo init --name <name> --folder <folder>' first."
+    def __init__(
+        self, db_path: Path, require_init: bool = True, rounding: str | None = None
+    ):
+        """Open a ledger, upgrading one written by an older release.
+
+        rounding is a decimal rounding mode (e.g. decimal.ROUND_HALF_UP)
+        applied to sub-cent amounts found by that upgrade. Without it such
+        amounts make the upgrade fail and leave the file untouched.
+        """
+        self.db_path = db_path if isinstance(db_path, Path) else Path(db_path)
+        # One long-lived connection keeps SQLite's statement and page caches
+        # warm across calls. It runs in autocommit mode; writes are grouped
+        # with _transaction().
+        if require_init:
+            # mode=rw makes SQLite refuse to create the file, which replaces
+            # a separate stat() before connecting.
+            try:
+                self._conn = self._connect("rw")
+            except sqlite3.DatabaseError as e:
+                raise self._open_error(e) from e
+        else:
+            self._conn = sqlite3.connect(
+                self.db_path, timeout=_BUSY_TIMEOUT,
+                isolation_level=None, check_same_thread=False,
             )
+            for pragma in _CONNECTION_PRAGMAS:
+                self._conn.execute(pragma)
+        # Read-only connections lent out by _reader(), most recently used
+        # first so the warmest page cache is picked. Each in-memory
+        # connection is its own database, so those read through _conn.
+        self._memory = str(self.db_path) == ":memory:"
+        self._readers: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue(
+            maxsize=_READER_POOL_SIZE
+        )
+        # Account name -> id. Accounts are never deleted, so entries stay
+        # valid; ids seen inside a transaction are only kept once it commits.
+        self._account_ids: dict[str, int] = {}
+        self._pending_account_ids: dict[str, int] = {}
+        # Threads share _conn, which can only hold one transaction at a
+        # time; _transaction() holds this for the whole of it.
+        self._write_lock = threading.Lock()
+        # (connection, its PRAGMA data_version, highest entry id, sorted
+        # line item accounts), so lookups that cannot match skip the query.
+        # See _lookups().
+        self._lookup_cache: tuple | None = None
+        self._cache_lock = threading.Lock()
+        if require_init:
+            try:
+                self._check_schema(rounding)
+            except BaseException:
+                self.close()
+                raise
 
     @classmethod
-    def init_database(cls, db_path: Path) -> "TransactionStorage":
-        db_path = Path(db_path)
+    def init_database(cls, db_path: Path, wal: bool = True) -> "TransactionStorage":
+        """Create the schema and return storage for the new database.
+
+        The database is switched to write-ahead logging, which is persistent
+        and lets commits append to the -wal file instead of rewriting a
+        rollback journal. WAL needs shared memory between processes, so pass
+        wal=False for a database kept on a network filesystem.
+        """
         storage = cls(db_path, require_init=False)
+        if wal:
+            storage._conn.execute("PRAGMA journal_mode = WAL")
         storage._init_db()
         return storage
 
+    def _connect(self, mode: str) -> sqlite3.Connection:
+        """Open a configured connection to the existing database file."""
+        conn = sqlite3.connect(
+            f"file:{quote(str(self.db_path))}?mode={mode}",
+            uri=True, timeout=_BUSY_TIMEOUT,
+            isolation_level=None, check_same_thread=False,
+        )
+        for pragma in _CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _open_error(self, error: sqlite3.DatabaseError) -> StorageError:
+        """Return the StorageError to raise when connecting failed with error."""
+        # Only now is it worth a stat() to tell why.
+        if not self.db_path.exists():
+            return DatabaseNotInitializedError(
+                f"Database not found at '{self.db_path}'. "
+                f"Run 'bozo init --name <name> --folder <folder>' first."
+            )
+        return DatabaseOpenError(f"Cannot open database at '{self.db_path}': {error}")
+
+    @contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        """Lend a pooled read-only connection, opening one if none is idle.
+
+        Readers only see committed data. Under WAL they run alongside each
+        other and the writer instead of queueing on the shared connection.
+        """
+        if self._memory:
+            yield self._conn
+            return
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            try:
+                conn = self._connect("ro")
+            except sqlite3.DatabaseError as e:
+                raise self._open_error(e) from e
+        try:
+            yield conn
+        finally:
+            try:
+                self._readers.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self) -> None:
+        """Close the underlying database connection and pooled readers."""
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        self._conn.close()
+
+    def __enter__(self) -> "TransactionStorage":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
     def _get_connection(self) -> sqlite3.Connection:
-        return sqlite3.connect(self.db_path)
+        return self._conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run the enclosed statements in one transaction on the shared connection.
+
+        Other threads of this storage wait on _write_lock. The database
+        lock is taken up front (BEGIN IMMEDIATE) so a writer in another
+        process makes us wait at the start rather than fail mid-transaction.
+        """
+        conn = self._conn
+        with self._write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+                self._account_ids.update(self._pending_account_ids)
+            finally:
+                self._pending_account_ids.clear()
+                # Our own commits leave _conn's data_version unchanged, and
+                # an in-memory reader may have cached uncommitted rows.
+                with self._cache_lock:
+                    self._lookup_cache = None
 
     def _init_db(self) -> None:
-        with self._get_connection() as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS journal_entries (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    description TEXT NOT NULL,
-                    timestamp TEXT NOT NULL
+        with self._transaction() as conn:
+            self._create_schema(conn)
+            conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+
+    def _check_schema(self, rounding: str | None = None) -> None:
+        """Upgrade a database from an older release, or refuse one we can't read."""
+        try:
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(line_items)")}
+        except sqlite3.DatabaseError as e:
+            raise DatabaseOpenError(
+                f"Cannot open database at '{self.db_path}': {e}"
+            ) from e
+        if version == _SCHEMA_VERSION:
+            return
+        if version > _SCHEMA_VERSION:
+            raise IncompatibleDatabaseError(
+                f"Database at '{self.db_path}' was written by a newer version of bozo."
+            )
+        if "debit" not in columns:
+            raise IncompatibleDatabaseError(
+                f"Database at '{self.db_path}' is not a bozo ledger."
+            )
+        try:
+            self._upgrade_from_v0(rounding)
+        except (sqlite3.DatabaseError, ValueError, ArithmeticError) as e:
+            raise IncompatibleDatabaseError(
+                f"Cannot upgrade database at '{self.db_path}': {e}"
+            ) from e
+
+    def _upgrade_from_v0(self, rounding: str | None = None) -> None:
+        """Convert a ledger with TEXT amounts and timestamps to the current schema.
+
+        The old tables are renamed, recreated, and copied row by row with
+        their ids, so the line_items_balance trigger fills account_balances
+        as it goes. The whole upgrade is one transaction.
+
+        Older releases accepted amounts with fractions of a cent. With
+        rounding they are rounded to the cent in that mode; otherwise the
+        first one found is reported with the command that rounds them.
+        """
+        def cents(text: str, entry_id: int) -> int:
+            amount = Decimal(text)
+            if rounding is not None:
+                amount = amount.quantize(_CENT, rounding=rounding)
+            elif amount != amount.quantize(_CENT):
+                raise IncompatibleDatabaseError(
+                    f"Cannot upgrade database at '{self.db_path}': entry #{entry_id} "
+                    f"has amount {text}, which has more than two decimal places. "
+                    f"Run 'bozo upgrade --round half-up -d {self.db_path}' to round "
+                    f"such amounts to the cent, or see 'bozo upgrade --help' for "
+                    f"other rounding modes."
                 )
-            """)
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS line_items (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    journal_entry_id INTEGER NOT NULL REFERENCES journal_entries(id),
-                    account TEXT NOT NULL,
-                    debit TEXT,
-                    credit TEXT,
-                    CHECK (
-                        (debit IS NOT NULL AND credit IS NULL) OR
-                        (debit IS NULL AND credit IS NOT NULL)
+            return _to_cents(amount)
+
+        with self._transaction() as conn:
+            # Another process may have upgraded it while we waited.
+            if conn.execute("PRAGMA user_version").fetchone()[0] == _SCHEMA_VERSION:
+                return
+            for trigger in _V0_TRIGGERS:
+                conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            conn.execute("ALTER TABLE journal_entries RENAME TO journal_entries_v0")
+            conn.execute("ALTER TABLE line_items RENAME TO line_items_v0")
+            self._create_schema(conn)
+            conn.executemany(
+                "INSERT INTO journal_entries (id, description, timestamp) VALUES (?, ?, ?)",
+                (
+                    (entry_id, description, _to_micros(datetime.fromisoformat(timestamp)))
+                    for entry_id, description, timestamp in conn.execute(
+                        "SELECT id, description, timestamp FROM journal_entries_v0 ORDER BY id"
+                    ).fetchall()
+                ),
+            )
+            conn.executemany(
+                "INSERT INTO line_items (id, journal_entry_id, account, debit_cents, credit_cents) VALUES (?, ?, ?, ?, ?)",
+                (
+                    (
+                        item_id,
+                        entry_id,
+                        account,
+                        cents(debit, entry_id) if debit is not None else None,
+                        cents(credit, entry_id) if credit is not None else None,
                     )
+                    for item_id, entry_id, account, debit, credit in conn.execute(
+                        "SELECT id, journal_entry_id, account, debit, credit FROM line_items_v0 ORDER BY id"
+                    ).fetchall()
+                ),
+            )
+            conn.execute("DROP TABLE line_items_v0")
+            conn.execute("DROP TABLE journal_entries_v0")
+            conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+
+    def _create_schema(self, conn: sqlite3.Connection) -> None:
+        """Create the current tables, triggers and indexes that don't exist yet."""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS journal_entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                description TEXT NOT NULL,
+                timestamp INTEGER NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS line_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                journal_entry_id INTEGER NOT NULL REFERENCES journal_entries(id),
+                account TEXT NOT NULL,
+                debit_cents INTEGER,
+                credit_cents INTEGER,
+                CHECK (
+                    (debit_cents IS NOT NULL AND credit_cents IS NULL) OR
+                    (debit_cents IS NULL AND credit_cents IS NOT NULL)
                 )
-            """)
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS accounts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL UNIQUE,
-                    type TEXT NOT NULL CHECK (type IN ('asset','liability','income','expense','capital','drawings')),
-                    parent_id INTEGER REFERENCES accounts(id)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS accounts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE,
+                type TEXT NOT NULL CHECK (type IN ('asset','liability','income','expense','capital','drawings')),
+                parent_id INTEGER REFERENCES accounts(id)
+            )
+        """)
+        # Immutability triggers for journal_entries
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS prevent_journal_entry_update
+            BEFORE UPDATE ON journal_entries
+            BEGIN
+                SELECT RAISE(ABORT, 'Journal entries cannot be modified');
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS prevent_journal_entry_delete
+            BEFORE DELETE ON journal_entries
+            BEGIN
+                SELECT RAISE(ABORT, 'Journal entries cannot be deleted');
+            END
+        """)
+        # Immutability triggers for line_items
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS prevent_line_item_update
+            BEFORE UPDATE ON line_items
+            BEGIN
+                SELECT RAISE(ABORT, 'Line items cannot be modified');
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS prevent_line_item_delete
+            BEFORE DELETE ON line_items
+            BEGIN
+                SELECT RAISE(ABORT, 'Line items cannot be deleted');
+            END
+        """)
+        # Indexes for loading an entry's line items and filtering by account
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_line_items_journal_entry_id
+            ON line_items(journal_entry_id)
+        """)
+        conn.execute(_ACCOUNT_INDEX)
+        # Lists one type of account already in name order
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_accounts_type_name
+            ON accounts(type, name)
+        """)
+        # Running totals per account, maintained as line items are recorded
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS account_balances (
+                account TEXT PRIMARY KEY,
+                debit_cents INTEGER NOT NULL,
+                credit_cents INTEGER NOT NULL
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS line_items_balance
+            AFTER INSERT ON line_items
+            BEGIN
+                INSERT INTO account_balances (account, debit_cents, credit_cents)
+                VALUES (
+                    NEW.account,
+                    COALESCE(NEW.debit_cents, 0),
+                    COALESCE(NEW.credit_cents, 0)
                 )
-            """)
-            # Immutability triggers for journal_entries
-            conn.execute("""
-                CREATE TRIGGER IF NOT EXISTS prevent_journal_entry_update
-                BEFORE UPDATE ON journal_entries
-                BEGIN
-                    SELECT RAISE(ABORT, 'Journal entries cannot be modified');
-                END
-            """)
-            conn.execute("""
-                CREATE TRIGGER IF NOT EXISTS prevent_journal_entry_delete
-                BEFORE DELETE ON journal_entries
-                BEGIN
-                    SELECT RAISE(ABORT, 'Journal entries cannot be deleted');
-                END
-            """)
-            # Immutability triggers for line_items
-            conn.execute("""
-                CREATE TRIGGER IF NOT EXISTS prevent_line_item_update
-                BEFORE UPDATE ON line_items
-                BEGIN
-                    SELECT RAISE(ABORT, 'Line items cannot be modified');
-                END
-            """)
-            conn.execute("""
-                CREATE TRIGGER IF NOT EXISTS prevent_line_item_delete
-                BEFORE DELETE ON line_items
-                BEGIN
-                    SELECT RAISE(ABORT, 'Line items cannot be deleted');
-                END
-            """)
-            conn.commit()
+                ON CONFLICT (account) DO UPDATE SET
+                    debit_cents = debit_cents + excluded.debit_cents,
+                    credit_cents = credit_cents + excluded.credit_cents;
+                -- SQLite turns an overflowing integer sum into a REAL
+                SELECT RAISE(ABORT, 'Account balance out of range')
+                FROM account_balances
+                WHERE account = NEW.account
+                    AND (typeof(debit_cents) != 'integer' OR typeof(credit_cents) != 'integer');
+            END
+        """)
 
     def create_account(self, account_name: str) -> None:
         """Create an account and any missing ancestors in its chain.
@@ -102,196 +573,253 @@ class TransactionStorage:
         Root accounts are created implicitly as needed.
         Raises ValueError if the leaf account already exists.
         """
-        account_name = account_name.lower()
+        account_name = _lower(account_name)
         acct_type, segments = parse_account_path(account_name)
-        with self._get_connection() as conn:
+        paths = [":".join(segments[:i]) for i in range(1, len(segments) + 1)]
+        with self._transaction() as conn:
+            ids = self._lookup_accounts(conn, paths)
             # Check if the leaf account already exists
-            leaf_path = ":".join(segments)
-            existing = conn.execute(
-                "SELECT id FROM accounts WHERE name = ?", (leaf_path,)
-            ).fetchone()
-            if existing:
+            leaf_path = paths[-1]
+            if leaf_path in ids:
                 raise ValueError(f"Account '{leaf_path}' already exists.")
-            # Create the full ancestor chain
-            for i in range(1, len(segments) + 1):
-                path = ":".join(segments[:i])
-                row = conn.execute(
-                    "SELECT id FROM accounts WHERE name = ?", (path,)
-                ).fetchone()
-                if row:
-                    continue
-                parent_id = None
-                if i > 1:
-                    parent_path = ":".join(segments[: i - 1])
-                    parent_row = conn.execute(
-                        "SELECT id FROM accounts WHERE name = ?", (parent_path,)
-                    ).fetchone()
-                    if parent_row:
-                        parent_id = parent_row[0]
-                conn.execute(
-                    "INSERT INTO accounts (name, type, parent_id) VALUES (?, ?, ?)",
-                    (path, acct_type, parent_id),
-                )
-            conn.commit()
+            # Create the missing part of the ancestor chain, parents first.
+            # Each row resolves its parent's id in SQLite, which sees the
+            # rows inserted before it in the same executemany.
+            missing = [path for path in paths if path not in ids]
+            conn.executemany(
+                """
+                INSERT INTO accounts (name, type, parent_id)
+                VALUES (?, ?, (SELECT id FROM accounts WHERE name = ?))
+                """,
+                [
+                    (path, acct_type, path.rpartition(":")[0] or None)
+                    for path in missing
+                ],
+            )
+            # Fetch the new ids, which _lookup_accounts caches on commit
+            self._lookup_accounts(conn, missing)
 
-    def _ensure_account(self, conn: sqlite3.Connection, account_name: str) -> None:
-        """Validate that an account exists. Auto-creates root accounts only."""
-        account_name = account_name.lower()
-        acct_type, segments = parse_account_path(account_name)
-        # Auto-create root account if missing
-        root = segments[0]
-        existing = conn.execute(
-            "SELECT id FROM accounts WHERE name = ?", (root,)
-        ).fetchone()
-        if not existing:
-            conn.execute(
-                "INSERT INTO accounts (name, type, parent_id) VALUES (?, ?, ?)",
-                (root, acct_type, None),
+    def _lookup_accounts(self, conn: sqlite3.Connection, names: Iterable[str]) -> dict[str, int]:
+        """Return {name: id} for those of names that exist.
+
+        Names already in the id cache cost nothing; the rest are fetched
+        with a single SELECT. Must be called inside _transaction().
+        """
+        found = {}
+        unknown = []
+        for name in dict.fromkeys(names):
+            if name in self._account_ids:
+                found[name] = self._account_ids[name]
+            else:
+                unknown.append(name)
+        if unknown:
+            placeholders = ",".join("?" * len(unknown))
+            rows = conn.execute(
+                f"SELECT name, id FROM accounts WHERE name IN ({placeholders})",
+                unknown,
             )
-        # For non-root accounts, verify the exact account exists
-        if len(segments) > 1:
-            full_path = ":".join(segments)
-            existing = conn.execute(
-                "SELECT id FROM accounts WHERE name = ?", (full_path,)
-            ).fetchone()
-            if not existing:
+            for name, account_id in rows:
+                found[name] = self._pending_account_ids[name] = account_id
+        return found
+
+    def _ensure_accounts(self, conn: sqlite3.Connection, account_names: Iterable[str]) -> None:
+        """Validate that accounts exist. Auto-creates root accounts only."""
+        roots = {}
+        leaves = []
+        for account_name in account_names:
+            acct_type, segments = parse_account_path(_lower(account_name))
+            roots[segments[0]] = acct_type
+            if len(segments) > 1:
+                leaves.append(":".join(segments))
+        existing = self._lookup_accounts(conn, [*roots, *leaves])
+        # Non-root accounts must have been created with add-account
+        for full_path in leaves:
+            if full_path not in existing:
                 raise ValueError(
                     f"Account '{full_path}' does not exist. "
                     f"Create it with: bozo add-account {full_path}"
                 )
+        # Auto-create missing root accounts
+        for root, acct_type in roots.items():
+            if root not in existing:
+                cursor = conn.execute(
+                    "INSERT INTO accounts (name, type, parent_id) VALUES (?, ?, NULL)",
+                    (root, acct_type),
+                )
+                self._pending_account_ids[root] = cursor.lastrowid
 
     def add(self, entry: JournalEntry) -> int:
-        with self._get_connection() as conn:
-            for item in entry.line_items:
-                self._ensure_account(conn, item.account)
-            cursor = conn.execute(
-                "INSERT INTO journal_entries (description, timestamp) VALUES (?, ?)",
-                (entry.description, entry.timestamp.isoformat()),
+        return self.add_many([entry])[0]
+
+    def add_many(
+        self, entries: Iterable[JournalEntry], defer_indexes: bool = False
+    ) -> list[int]:
+        """Record several journal entries in a single transaction.
+
+        Returns the new entry ids in order. If any entry is rejected none
+        of them are stored.
+
+        With defer_indexes=True the account index is dropped for the load
+        and rebuilt in one pass before committing, which is faster for large
+        imports but slower for small batches into a big ledger. The
+        immutability triggers stay in place either way.
+        """
+        entries = list(entries)
+        entry_ids = []
+        line_rows = []
+        with self._transaction() as conn:
+            if defer_indexes:
+                conn.execute("DROP INDEX IF EXISTS idx_line_items_account")
+            self._ensure_accounts(
+                conn, (item.account for entry in entries for item in entry.line_items)
             )
-            entry_id = cursor.lastrowid
-            for item in entry.line_items:
-                conn.execute(
-                    "INSERT INTO line_items (journal_entry_id, account, debit, credit) VALUES (?, ?, ?, ?)",
+            for entry in entries:
+                cursor = conn.execute(
+                    "INSERT INTO journal_entries (description, timestamp) VALUES (?, ?)",
+                    (entry.description, _to_micros(entry.timestamp)),
+                )
+                entry_id = cursor.lastrowid
+                entry_ids.append(entry_id)
+                line_rows.extend(
                     (
                         entry_id,
-                        item.account.lower(),
-                        str(item.debit) if item.debit is not None else None,
-                        str(item.credit) if item.credit is not None else None,
-                    ),
+                        _lower(item.account),
+                        _to_cents(item.debit) if item.debit is not None else None,
+                        _to_cents(item.credit) if item.credit is not None else None,
+                    )
+                    for item in entry.line_items
                 )
-            conn.commit()
-            return entry_id
+            try:
+                conn.executemany(
+                    "INSERT INTO line_items (journal_entry_id, account, debit_cents, credit_cents) VALUES (?, ?, ?, ?)",
+                    line_rows,
+                )
+            except sqlite3.IntegrityError as e:
+                if str(e) != _BALANCE_OVERFLOW:
+                    raise
+                raise ValueError(f"{_BALANCE_OVERFLOW}; entry not recorded.") from e
+            if defer_indexes:
+                conn.execute(_ACCOUNT_INDEX)
+        return entry_ids
 
     def get_all(self) -> list[JournalEntry]:
-        with self._get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            entries = conn.execute(
-                "SELECT * FROM journal_entries ORDER BY timestamp DESC"
-            ).fetchall()
-            return [self._load_entry(conn, row) for row in entries]
+        return list(self.iter_all())
+
+    def iter_all(self) -> Iterator[JournalEntry]:
+        """Yield all journal entries, newest first, one at a time."""
+        with self._reader() as conn:
+            rows = conn.execute(
+                _ENTRY_QUERY + "ORDER BY je.timestamp DESC, je.id, li.id"
+            )
+            yield from self._group_entries(rows)
 
     def get_by_id(self, entry_id: int) -> JournalEntry | None:
-        with self._get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            row = conn.execute(
-                "SELECT * FROM journal_entries WHERE id = ?", (entry_id,)
-            ).fetchone()
-            if row is None:
+        with self._reader() as conn:
+            if entry_id > self._lookups(conn)[0]:
                 return None
-            return self._load_entry(conn, row)
+            rows = conn.execute(_ENTRY_BY_ID_QUERY, (entry_id,))
+            return next(self._group_entries(rows), None)
 
     def get_by_account(self, account: str) -> list[JournalEntry]:
-        account = account.lower()
-        with self._get_connection() as conn:
-            conn.row_factory = sqlite3.Row
-            entry_ids = conn.execute(
-                "SELECT DISTINCT journal_entry_id FROM line_items WHERE account = ? OR account LIKE ?",
-                (account, account + ":%"),
-            ).fetchall()
-            ids = [r["journal_entry_id"] for r in entry_ids]
-            if not ids:
-                return []
-            placeholders = ",".join("?" * len(ids))
-            entries = conn.execute(
-                f"SELECT * FROM journal_entries WHERE id IN ({placeholders}) ORDER BY timestamp DESC",
-                ids,
-            ).fetchall()
-            return [self._load_entry(conn, row) for row in entries]
+        return list(self.iter_by_account(account))
+
+    def iter_by_account(self, account: str) -> Iterator[JournalEntry]:
+        """Yield entries touching an account or its subtree, newest first."""
+        account = _lower(account)
+        with self._reader() as conn:
+            if not _has_subtree(self._lookups(conn)[1], account):
+                return
+            rows = conn.execute(_SUBTREE_ENTRY_QUERY, _subtree(account))
+            yield from self._group_entries(rows)
+
+    def _lookups(self, conn: sqlite3.Connection) -> tuple[int, list[str]]:
+        """Return the highest entry id and the sorted accounts of line items.
+
+        Both are cached until conn's PRAGMA data_version shows a commit by
+        another connection, or one of ours clears the cache. Clearing waits
+        on the lock for any fill in progress, so a copy read before a commit
+        cannot be stored after it.
+        """
+        with self._cache_lock:
+            # Read before the SELECTs, so a commit between them only costs
+            # a reload next time.
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            cache = self._lookup_cache
+            if cache is None or cache[0] is not conn or cache[1] != version:
+                max_entry_id = conn.execute(
+                    "SELECT COALESCE(MAX(id), 0) FROM journal_entries"
+                ).fetchone()[0]
+                names = [
+                    name for name, in conn.execute(
+                        "SELECT account FROM account_balances ORDER BY account"
+                    )
+                ]
+                cache = self._lookup_cache = (conn, version, max_entry_id, names)
+            return cache[2], cache[3]
 
     def get_accounts(self, account_type: str | None = None) -> list[Account]:
-        with self._get_connection() as conn:
-            conn.row_factory = sqlite3.Row
+        with self._reader() as conn:
             if account_type:
-                rows = conn.execute(
-                    "SELECT * FROM accounts WHERE type = ? ORDER BY name",
-                    (account_type,),
-                ).fetchall()
+                rows = conn.execute(_ACCOUNTS_BY_TYPE_QUERY, (account_type,))
             else:
-                rows = conn.execute(
-                    "SELECT * FROM accounts ORDER BY name"
-                ).fetchall()
-            return [
-                Account(
-                    id=row["id"],
-                    name=row["name"],
-                    type=row["type"],
-                    parent_id=row["parent_id"],
-                )
-                for row in rows
-            ]
+                rows = conn.execute(_ACCOUNTS_QUERY)
+            return [Account(*row) for row in rows]
 
     def get_trial_balance(self, account: str | None = None) -> dict:
-        with self._get_connection() as conn:
-            conn.row_factory = sqlite3.Row
+        return self.get_trial_balance_with_totals(account)[0]
+
+    def get_trial_balance_with_totals(
+        self, account: str | None = None
+    ) -> tuple[dict, tuple[Decimal, Decimal]]:
+        """Return get_trial_balance() and its (total_debits, total_credits).
+
+        The totals are summed from the same rows, so unlike separate
+        get_trial_balance() and get_trial_balance_totals() calls they cannot
+        include entries committed in between. They are Python ints, which
+        don't overflow where SQLite's SUM() would.
+        """
+        with self._reader() as conn:
             if account:
-                account = account.lower()
-                rows = conn.execute("""
-                    SELECT
-                        account,
-                        SUM(CASE WHEN debit IS NOT NULL THEN CAST(debit AS REAL) ELSE 0 END) as total_debits,
-                        SUM(CASE WHEN credit IS NOT NULL THEN CAST(credit AS REAL) ELSE 0 END) as total_credits
-                    FROM line_items
-                    WHERE account = ? OR account LIKE ?
-                    GROUP BY account
-                    ORDER BY account
-                """, (account, account + ":%")).fetchall()
+                account = _lower(account)
+                rows = conn.execute(_SUBTREE_BALANCE_QUERY, _subtree(account))
             else:
-                rows = conn.execute("""
-                    SELECT
-                        account,
-                        SUM(CASE WHEN debit IS NOT NULL THEN CAST(debit AS REAL) ELSE 0 END) as total_debits,
-                        SUM(CASE WHEN credit IS NOT NULL THEN CAST(credit AS REAL) ELSE 0 END) as total_credits
-                    FROM line_items
-                    GROUP BY account
-                    ORDER BY account
-                """).fetchall()
+                rows = conn.execute(_BALANCE_QUERY)
             accounts = {}
-            for row in rows:
-                total_debits = Decimal(str(row["total_debits"]))
-                total_credits = Decimal(str(row["total_credits"]))
-                accounts[row["account"]] = {
-                    "debits": total_debits,
-                    "credits": total_credits,
-                    "net": total_debits - total_credits,
+            total_debit_cents = total_credit_cents = 0
+            for name, debit_cents, credit_cents in rows:
+                accounts[name] = {
+                    "debits": _from_cents(debit_cents),
+                    "credits": _from_cents(credit_cents),
+                    # Exact integer subtraction; no Decimal arithmetic
+                    "net": _from_cents(debit_cents - credit_cents),
                 }
-            return accounts
-
-    def _load_entry(self, conn: sqlite3.Connection, row: sqlite3.Row) -> JournalEntry:
-        items = conn.execute(
-            "SELECT * FROM line_items WHERE journal_entry_id = ?", (row["id"],)
-        ).fetchall()
-        line_items = [
-            LineItem(
-                id=item["id"],
-                account=item["account"],
-                debit=Decimal(item["debit"]) if item["debit"] is not None else None,
-                credit=Decimal(item["credit"]) if item["credit"] is not None else None,
+                total_debit_cents += debit_cents
+                total_credit_cents += credit_cents
+            return accounts, (_from_cents(total_debit_cents), _from_cents(total_credit_cents))
+
+    def get_trial_balance_totals(self, account: str | None = None) -> tuple[Decimal, Decimal]:
+        """Return (total_debits, total_credits).
+
+        Scoped to an account subtree in the same way as get_trial_balance.
+        """
+        return self.get_trial_balance_with_totals(account)[1]
+
+    def _group_entries(self, rows: Iterable[tuple]) -> Iterator[JournalEntry]:
+        """Build journal entries from _ENTRY_QUERY rows, which arrive grouped by entry."""
+        for (entry_id, description, timestamp), group in groupby(rows, key=itemgetter(0, 1, 2)):
+            line_items = [
+                LineItem(
+                    account,
+                    _from_cents(debit_cents) if debit_cents is not None else None,
+                    _from_cents(credit_cents) if credit_cents is not None else None,
+                    line_item_id,
+                )
+                for _, _, _, line_item_id, account, debit_cents, credit_cents in group
+                if line_item_id is not None
+            ]
+            yield JournalEntry(
+                description,
+                _from_micros(timestamp),
+                line_items,
+                entry_id,
             )
-            for item in items
-        ]
-        return JournalEntry(
-            id=row["id"],
-            description=row["description"],
-            timestamp=datetime.fromisoformat(row["timestamp"]),
-            line_items=line_items,
-        )
@@ -1,9 +1,12 @@
 """Journal entry and line item models for double-entry accounting."""
 
+import functools
 from dataclasses import dataclass, field
 from datetime import datetime
 from decimal import Decimal
 
+ZERO = Decimal(0)
+
 ACCOUNT_TYPES = {
     "assets": "asset",
     "liabilities": "liability",
@@ -14,24 +17,27 @@ ACCOUNT_TYPES = {
 }
 
 
-def parse_account_path(name: str) -> tuple[str, list[str]]:
+@functools.lru_cache(maxsize=4096)
+def parse_account_path(name: str) -> tuple[str, tuple[str, ...]]:
     """Split an account name on ':' and validate the root segment.
 
     Returns (type, segments). Raises ValueError for invalid roots.
+    Results are cached, so segments is an immutable tuple.
     """
-    segments = [s.strip() for s in name.lower().split(":")]
+    segments = tuple(s.strip() for s in name.lower().split(":"))
     if not segments or not segments[0]:
         raise ValueError(f"Invalid account name: '{name}'")
     root = segments[0]
-    if root not in ACCOUNT_TYPES:
+    acct_type = ACCOUNT_TYPES.get(root)
+    if acct_type is None:
         valid = ", ".join(sorted(ACCOUNT_TYPES))
         raise ValueError(
             f"Invalid account root '{root}'. Must be one of: {valid}"
         )
-    return ACCOUNT_TYPES[root], segments
+    return acct_type, segments
 
 
-@dataclass
+@dataclass(slots=True)
 class Account:
     """A ledger account in the chart of accounts."""
 
@@ -41,7 +47,7 @@ class Account:
     id: int | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class LineItem:
     """A single debit or credit line in a journal entry."""
 
@@ -51,7 +57,7 @@ class LineItem:
     id: int | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class JournalEntry:
     """A double-entry journal entry with balanced debits and credits."""
 
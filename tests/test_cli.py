@@ -0,0 +1,301 @@
+"""Tests for cli module."""
+
+import sqlite3
+from decimal import Decimal
+
+import pytest
+
+from bozo.cli import (
+    _STORAGE_CACHE_SIZE,
+    _close_storages,
+    _fast_parse,
+    _open_storage,
+    _storages,
+    create_parser,
+    main,
+)
+from tests.test_storage import create_v0_database, v0_entries
+
+ALL_COMMANDS = "{init,record,list,summary,add-account,accounts,upgrade}"
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """Initialize a database through the CLI and return its path."""
+    assert main(["init", "--name", "test", "--folder", str(tmp_path)]) == 0
+    return tmp_path / "test.bozo"
+
+
+def test_create_parser_builds_only_requested_subcommand():
+    """Test that a known command only registers its own subparser."""
+    parser = create_parser("record")
+    subparsers = parser._subparsers._group_actions[0]
+    assert list(subparsers.choices) == ["record"]
+
+
+def test_create_parser_builds_all_subcommands_by_default():
+    """Test that top-level parsing registers every subparser."""
+    parser = create_parser()
+    subparsers = parser._subparsers._group_actions[0]
+    assert list(subparsers.choices) == [
+        "init", "record", "list", "summary", "add-account", "accounts", "upgrade",
+    ]
+
+
+def test_create_parser_without_help_text():
+    """Test that help strings are only attached when help is wanted."""
+    assert "Record a journal entry" in create_parser("record").format_help()
+    assert "Record a journal entry" not in create_parser("record", with_help=False).format_help()
+
+
+def test_subcommand_help(capsys):
+    """Test that subcommand help shows argument descriptions."""
+    with pytest.raises(SystemExit):
+        main(["record", "--help"])
+    assert "Account to credit" in capsys.readouterr().out
+
+
+def test_create_parser_is_cached():
+    """Test that parsers are built once per command."""
+    assert create_parser("list") is create_parser("list")
+    assert create_parser("list") is not create_parser("summary")
+
+
+@pytest.mark.parametrize("argv", [
+    ["init", "--name", "ledger"],
+    ["init", "--name=ledger", "--folder", "/tmp"],
+    ["record", "50", "Pay", "--debit", "assets:cash", "--credit", "income:salary"],
+    ["record", "--debit=assets:cash", "50", "--credit", "income", "Pay", "-d", "x.bozo"],
+    ["list"],
+    ["list", "-a", "expenses", "--database", "x.bozo"],
+    ["summary", "--account=assets"],
+    ["add-account", "assets:bank", "-d", "x.bozo"],
+    ["accounts", "--type", "asset"],
+])
+def test_fast_parse_matches_argparse(argv):
+    """Test that the fast path produces the same namespace as argparse."""
+    assert _fast_parse(argv) == create_parser().parse_args(argv)
+
+
+@pytest.mark.parametrize("argv", [
+    [],
+    ["--help"],
+    ["record", "--help"],
+    ["record", "abc", "Pay", "--debit", "assets", "--credit", "income"],
+    ["record", "50", "Pay", "--debit", "assets"],
+    ["list", "--acc", "assets"],
+    ["list", "-d"],
+    ["add-account"],
+])
+def test_fast_parse_defers_to_argparse(argv):
+    """Test that unusual command lines are left to argparse."""
+    assert _fast_parse(argv) is None
+
+
+def test_record_amount_is_exact_decimal():
+    """Test that amounts are parsed to Decimal without a float step."""
+    args = _fast_parse(["record", "0.10", "Pay", "--debit", "assets", "--credit", "income"])
+    assert args.amount == Decimal("0.10")
+
+
+def test_record_invalid_amount(capsys):
+    """Test that a non-numeric amount is an argument error."""
+    with pytest.raises(SystemExit):
+        main(["record", "abc", "Pay", "--debit", "assets", "--credit", "income"])
+    assert "invalid amount: 'abc'" in capsys.readouterr().err
+
+
+def test_unknown_command_lists_choices(capsys):
+    """Test that an unknown command reports all valid choices."""
+    with pytest.raises(SystemExit):
+        main(["bogus"])
+    err = capsys.readouterr().err
+    assert "invalid choice" in err
+    assert "add-account" in err
+
+
+def test_help_flag_before_command_lists_all_commands(capsys):
+    """Test that a flag before the command still gets top-level help."""
+    with pytest.raises(SystemExit):
+        main(["-h", "record"])
+    assert ALL_COMMANDS in capsys.readouterr().out
+
+
+def test_usage_error_lists_all_commands(capsys):
+    """Test that usage from a single-command parser names every command."""
+    with pytest.raises(SystemExit):
+        main(["list", "--bogus"])
+    assert ALL_COMMANDS in capsys.readouterr().err
+
+
+def test_init_existing_database(db_path, capsys):
+    """Test that init refuses to overwrite an existing database."""
+    capsys.readouterr()
+    assert main(["init", "--name", "test", "--folder", str(db_path.parent)]) == 1
+    assert "already exists" in capsys.readouterr().out
+
+
+def test_record_and_list(db_path, capsys):
+    """Test recording an entry and listing it."""
+    assert main(["add-account", "expenses:food", "-d", str(db_path)]) == 0
+    assert main(["add-account", "assets:cash", "-d", str(db_path)]) == 0
+    assert main([
+        "record", "12.50", "Groceries",
+        "--debit", "expenses:food", "--credit", "assets:cash",
+        "-d", str(db_path),
+    ]) == 0
+    capsys.readouterr()
+    assert main(["list", "-d", str(db_path)]) == 0
+    out = capsys.readouterr().out
+    assert "Groceries" in out
+    assert "expenses:food" in out
+    assert "12.50" in out
+
+
+def test_record_amount_too_large(db_path, capsys):
+    """Test that an amount too large to store is reported, not raised."""
+    assert main([
+        "record", "1e17", "Huge",
+        "--debit", "assets", "--credit", "income",
+        "-d", str(db_path),
+    ]) == 1
+    assert "too large" in capsys.readouterr().err
+
+
+def test_summary(db_path, capsys):
+    """Test the trial balance output."""
+    main(["add-account", "assets:cash", "-d", str(db_path)])
+    main(["add-account", "income:salary", "-d", str(db_path)])
+    main([
+        "record", "100", "Pay",
+        "--debit", "assets:cash", "--credit", "income:salary",
+        "-d", str(db_path),
+    ])
+    capsys.readouterr()
+    assert main(["summary", "-d", str(db_path)]) == 0
+    out = capsys.readouterr().out
+    assert "  cash" in out
+    assert "TOTAL" in out
+    assert "100.00" in out
+
+
+def test_database_from_environment(db_path, monkeypatch, capsys):
+    """Test that BOZO_DB is used when -d is not given."""
+    monkeypatch.setenv("BOZO_DB", str(db_path))
+    assert main(["accounts"]) == 0
+    assert "No accounts found." in capsys.readouterr().out
+
+
+def test_missing_database(monkeypatch, capsys):
+    """Test the error when no database is specified."""
+    monkeypatch.delenv("BOZO_DB", raising=False)
+    assert main(["list"]) == 1
+    assert "No database specified" in capsys.readouterr().err
+
+
+def test_unopenable_database(tmp_path, capsys):
+    """Test that a database path that can't be opened is reported."""
+    assert main(["list", "-d", str(tmp_path)]) == 1
+    err = capsys.readouterr().err
+    assert "Cannot open database" in err
+    assert "not found" not in err
+
+
+def test_non_ledger_database(tmp_path, capsys):
+    """Test that an SQLite file that isn't a ledger is reported."""
+    db_path = tmp_path / "other.bozo"
+    sqlite3.connect(db_path).execute("CREATE TABLE t (x)").connection.close()
+    assert main(["summary", "-d", str(db_path)]) == 1
+    assert "not a bozo ledger" in capsys.readouterr().err
+
+
+def test_upgrade_rounds_sub_cent_amounts(tmp_path, capsys):
+    """Test that a v0 ledger with a sub-cent amount is usable after 'upgrade --round'."""
+    db_path = tmp_path / "old.bozo"
+    create_v0_database(db_path, *v0_entries(Decimal("12.345")))
+    assert main(["list", "-d", str(db_path)]) == 1
+    assert "bozo upgrade --round" in capsys.readouterr().err
+    assert main(["upgrade", "--round", "half-up", "-d", str(db_path)]) == 0
+    assert "up to date" in capsys.readouterr().out
+    assert main(["list", "-d", str(db_path)]) == 0
+    assert "12.35" in capsys.readouterr().out
+
+
+def test_init_missing_folder(tmp_path, capsys):
+    """Test that init reports a folder that does not exist."""
+    assert main(["init", "--name", "test", "--folder", str(tmp_path / "missing")]) == 1
+    assert "does not exist" in capsys.readouterr().err
+
+
+def test_storage_reused_across_calls(db_path):
+    """Test that repeated commands against one database share its storage."""
+    main(["accounts", "-d", str(db_path)])
+    storage = _open_storage(str(db_path))
+    main(["accounts", "-d", str(db_path)])
+    assert _open_storage(str(db_path)) is storage
+
+
+def test_evicted_storages_are_closed(tmp_path):
+    """Test that storages dropped from the cache have their connections closed."""
+    _close_storages()
+    paths = []
+    for i in range(_STORAGE_CACHE_SIZE + 1):
+        assert main(["init", "--name", f"ledger{i}", "--folder", str(tmp_path)]) == 0
+        paths.append(str(tmp_path / f"ledger{i}.bozo"))
+    storages = [_open_storage(path) for path in paths]
+    assert list(_storages) == paths[1:]
+    with pytest.raises(sqlite3.ProgrammingError):
+        storages[0]._get_connection().execute("SELECT 1")
+    _close_storages()
+    assert not _storages
+    with pytest.raises(sqlite3.ProgrammingError):
+        storages[-1]._get_connection().execute("SELECT 1")
+
+
+def delete_ledger(db_path):
+    """Helper to remove a ledger file and its WAL sidecar files."""
+    for path in db_path.parent.glob(db_path.name + "*"):
+        path.unlink()
+
+
+def test_deleted_database_reported_missing(db_path, capsys):
+    """Test that a ledger deleted after it was cached is reported as not found."""
+    assert main(["accounts", "-d", str(db_path)]) == 0
+    delete_ledger(db_path)
+    capsys.readouterr()
+    assert main(["list", "-d", str(db_path)]) == 1
+    assert "not found" in capsys.readouterr().err
+
+
+def test_reinitialized_database_is_reopened(db_path, capsys):
+    """Test that commands after deleting and re-initializing a ledger use the new file."""
+    record = [
+        "record", "1", "Pay", "--debit", "assets", "--credit", "income",
+        "-d", str(db_path),
+    ]
+    assert main(record) == 0
+    delete_ledger(db_path)
+    assert main(["init", "--name", "test", "--folder", str(db_path.parent)]) == 0
+    capsys.readouterr()
+    assert main(record) == 0
+    assert "Recorded entry #1" in capsys.readouterr().out
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM journal_entries").fetchone() == (1,)
+    conn.close()
+
+
+def test_list_flushes_in_chunks(db_path, monkeypatch, capsys):
+    """Test that list output is complete when rows are flushed in chunks."""
+    monkeypatch.setattr("bozo.cli._FLUSH_LINES", 3)
+    main(["add-account", "assets:cash", "-d", str(db_path)])
+    for i in range(5):
+        main([
+            "record", "1", f"Entry {i}",
+            "--debit", "assets:cash", "--credit", "income",
+            "-d", str(db_path),
+        ])
+    capsys.readouterr()
+    assert main(["list", "-d", str(db_path)]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 7
+    assert sorted(line.split()[0] for line in lines[2:]) == ["1", "2", "3", "4", "5"]
@@ -1,28 +1,93 @@
 """Tests for storage module."""
 
-from datetime import datetime
-from decimal import Decimal
+import re
+import shutil
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import ROUND_DOWN, ROUND_HALF_EVEN, ROUND_HALF_UP, Decimal
 
 import pytest
 
-from bozo.storage import DatabaseNotInitializedError, TransactionStorage
+from bozo.storage import (
+    _ACCOUNTS_BY_TYPE_QUERY,
+    _ENTRY_BY_ID_QUERY,
+    _SUBTREE_BALANCE_QUERY,
+    _SUBTREE_ENTRY_QUERY,
+    _lower,
+    DatabaseNotInitializedError,
+    DatabaseOpenError,
+    IncompatibleDatabaseError,
+    TransactionStorage,
+)
 from bozo.transaction import JournalEntry, LineItem
 
+TS = datetime(2024, 1, 15, 10, 30)
+
+D10 = Decimal("10.00")
+D25 = Decimal("25.00")
+D30 = Decimal("30.00")
+D50 = Decimal("50.00")
+D100 = Decimal("100.00")
+D500 = Decimal("500.00")
+D1000 = Decimal("1000.00")
+
+ALREADY_EXISTS_RE = re.compile("already exists")
+DOES_NOT_EXIST_RE = re.compile("does not exist")
+INVALID_ROOT_RE = re.compile("Invalid account root")
+SUB_CENT_RE = re.compile("more than two decimal places")
+TOO_LARGE_RE = re.compile("too large")
+BALANCE_OUT_OF_RANGE_RE = re.compile("Account balance out of range")
+TIMEZONE_AWARE_RE = re.compile("timezone-aware")
+NEWER_VERSION_RE = re.compile("newer version")
+NOT_A_LEDGER_RE = re.compile("not a bozo ledger")
+
+
+@pytest.fixture(scope="session")
+def schema_template(tmp_path_factory):
+    """Create an initialized database once for the session to copy from."""
+    path = tmp_path_factory.mktemp("template") / "template.bozo"
+    # Closing checkpoints the WAL, so the copy is complete on its own.
+    TransactionStorage.init_database(path).close()
+    return path
+
+
+@pytest.fixture
+def storage(schema_template):
+    """Create a storage instance with an initialized in-memory database."""
+    with TransactionStorage(":memory:", require_init=False) as storage:
+        template = sqlite3.connect(schema_template)
+        template.backup(storage._get_connection())
+        template.close()
+        yield storage
+
 
 @pytest.fixture
-def storage(tmp_path):
-    """Create a storage instance with an initialized database."""
-    return TransactionStorage.init_database(tmp_path / "test.bozo")
+def disk_storage(schema_template, tmp_path):
+    """Create a storage instance with an initialized database file."""
+    db_path = tmp_path / "test.bozo"
+    shutil.copyfile(schema_template, db_path)
+    with TransactionStorage(db_path) as storage:
+        yield storage
 
 
-def make_entry(description="Test", debit_acct="assets:cash", credit_acct="income:revenue", amount="50.00"):
+@pytest.fixture(scope="class")
+def memory_storage():
+    """Create an in-memory storage holding one entry, shared across a class."""
+    with TransactionStorage.init_database(":memory:") as storage:
+        create_accounts(storage, "assets:cash", "income:revenue")
+        storage.add(make_entry())
+        yield storage
+
+
+def make_entry(description="Test", debit_acct="assets:cash", credit_acct="income:revenue", amount=D50):
     """Helper to create a journal entry."""
     return JournalEntry(
         description=description,
-        timestamp=datetime(2024, 1, 15, 10, 30),
+        timestamp=TS,
         line_items=[
-            LineItem(account=debit_acct, debit=Decimal(amount)),
-            LineItem(account=credit_acct, credit=Decimal(amount)),
+            LineItem(account=debit_acct, debit=amount),
+            LineItem(account=credit_acct, credit=amount),
         ],
     )
 
@@ -43,8 +108,10 @@ def test_add_entry(storage):
 def test_get_all_entries(storage):
     """Test retrieving all journal entries."""
     create_accounts(storage, "assets:cash", "income:revenue", "expenses:food")
-    storage.add(make_entry("Salary"))
-    storage.add(make_entry("Groceries", "expenses:food", "assets:cash", "25.00"))
+    storage.add_many([
+        make_entry("Salary"),
+        make_entry("Groceries", "expenses:food", "assets:cash", D25),
+    ])
     entries = storage.get_all()
     assert len(entries) == 2
 
@@ -57,8 +124,29 @@ def test_get_by_id(storage):
     assert retrieved is not None
     assert retrieved.description == "Salary"
     assert len(retrieved.line_items) == 2
-    assert retrieved.line_items[0].debit == Decimal("50.00")
-    assert retrieved.line_items[1].credit == Decimal("50.00")
+    assert retrieved.line_items[0].debit == D50
+    assert retrieved.line_items[1].credit == D50
+
+
+def test_timestamp_round_trip(storage):
+    """Test that timestamps are stored as integers and read back exactly."""
+    create_accounts(storage, "assets:cash", "income:revenue")
+    entry = make_entry()
+    entry.timestamp = datetime(2024, 3, 31, 2, 30, 15, 123456)
+    entry_id = storage.add(entry)
+    assert storage.get_by_id(entry_id).timestamp == entry.timestamp
+    stored = storage._conn.execute("SELECT timestamp FROM journal_entries").fetchone()[0]
+    assert isinstance(stored, int)
+
+
+def test_timezone_aware_timestamp_rejected(storage):
+    """Test that an aware timestamp is refused rather than shifted."""
+    create_accounts(storage, "assets:cash", "income:revenue")
+    entry = make_entry()
+    entry.timestamp = datetime(2024, 3, 31, 2, 30, tzinfo=timezone.utc)
+    with pytest.raises(ValueError, match=TIMEZONE_AWARE_RE):
+        storage.add(entry)
+    assert storage.get_all() == []
 
 
 def test_get_by_id_not_found(storage):
@@ -69,9 +157,11 @@ def test_get_by_id_not_found(storage):
 def test_get_by_account(storage):
     """Test filtering entries by account."""
     create_accounts(storage, "assets:cash", "income:revenue", "expenses:food", "expenses:rent")
-    storage.add(make_entry("Salary", "assets:cash", "income:revenue", "1000.00"))
-    storage.add(make_entry("Groceries", "expenses:food", "assets:cash", "30.00"))
-    storage.add(make_entry("Rent", "expenses:rent", "assets:cash", "500.00"))
+    storage.add_many([
+        make_entry("Salary", "assets:cash", "income:revenue", D1000),
+        make_entry("Groceries", "expenses:food", "assets:cash", D30),
+        make_entry("Rent", "expenses:rent", "assets:cash", D500),
+    ])
 
     cash_entries = storage.get_by_account("assets:cash")
     assert len(cash_entries) == 3  # cash appears in all three
@@ -86,9 +176,11 @@ def test_get_by_account(storage):
 def test_get_by_account_prefix(storage):
     """Test that get_by_account matches subtrees."""
     create_accounts(storage, "assets:bank:checking", "assets:cash", "income:revenue", "expenses:food")
-    storage.add(make_entry("Salary", "assets:bank:checking", "income:revenue", "1000.00"))
-    storage.add(make_entry("Groceries", "expenses:food", "assets:bank:checking", "30.00"))
-    storage.add(make_entry("Petty cash", "assets:cash", "assets:bank:checking", "50.00"))
+    storage.add_many([
+        make_entry("Salary", "assets:bank:checking", "income:revenue", D1000),
+        make_entry("Groceries", "expenses:food", "assets:bank:checking", D30),
+        make_entry("Petty cash", "assets:cash", "assets:bank:checking", D50),
+    ])
 
     # "assets" should match all entries (all touch an assets: account)
     assets_entries = storage.get_by_account("assets")
@@ -108,89 +200,77 @@ def test_get_by_account_empty(storage):
     assert storage.get_by_account("nonexistent") == []
 
 
-def test_immutable_no_delete_journal_entry(storage):
-    """Test that journal entries cannot be deleted."""
-    create_accounts(storage, "assets:cash", "income:revenue")
-    entry_id = storage.add(make_entry())
-    with storage._get_connection() as conn:
-        try:
-            conn.execute("DELETE FROM journal_entries WHERE id = ?", (entry_id,))
-            assert False, "Delete should have been prevented"
-        except Exception as e:
-            assert "cannot be deleted" in str(e)
-    assert storage.get_by_id(entry_id) is not None
-
-
-def test_immutable_no_update_journal_entry(storage):
-    """Test that journal entries cannot be modified."""
-    create_accounts(storage, "assets:cash", "income:revenue")
-    entry_id = storage.add(make_entry())
-    with storage._get_connection() as conn:
-        try:
-            conn.execute(
-                "UPDATE journal_entries SET description = ? WHERE id = ?",
-                ("hacked", entry_id),
-            )
-            assert False, "Update should have been prevented"
-        except Exception as e:
-            assert "cannot be modified" in str(e)
-
-
-def test_immutable_no_delete_line_item(storage):
-    """Test that line items cannot be deleted."""
-    create_accounts(storage, "assets:cash", "income:revenue")
-    storage.add(make_entry())
-    with storage._get_connection() as conn:
-        try:
-            conn.execute("DELETE FROM line_items WHERE id = 1")
-            assert False, "Delete should have been prevented"
-        except Exception as e:
-            assert "cannot be deleted" in str(e)
-
-
-def test_immutable_no_update_line_item(storage):
-    """Test that line items cannot be modified."""
-    create_accounts(storage, "assets:cash", "income:revenue")
-    storage.add(make_entry())
-    with storage._get_connection() as conn:
-        try:
-            conn.execute("UPDATE line_items SET debit = '999.99' WHERE id = 1")
-            assert False, "Update should have been prevented"
-        except Exception as e:
-            assert "cannot be modified" in str(e)
+class TestImmutable:
+    """Journal entries and line items reject changes once recorded."""
+
+    def test_no_delete_journal_entry(self, memory_storage):
+        """Test that journal entries cannot be deleted."""
+        with memory_storage._get_connection() as conn:
+            try:
+                conn.execute("DELETE FROM journal_entries WHERE id = 1")
+                assert False, "Delete should have been prevented"
+            except Exception as e:
+                assert "cannot be deleted" in str(e)
+        assert memory_storage.get_by_id(1) is not None
+
+    def test_no_update_journal_entry(self, memory_storage):
+        """Test that journal entries cannot be modified."""
+        with memory_storage._get_connection() as conn:
+            try:
+                conn.execute(
+                    "UPDATE journal_entries SET description = ? WHERE id = 1",
+                    ("hacked",),
+                )
+                assert False, "Update should have been prevented"
+            except Exception as e:
+                assert "cannot be modified" in str(e)
+        assert memory_storage.get_by_id(1).description == "Test"
+
+    def test_no_delete_line_item(self, memory_storage):
+        """Test that line items cannot be deleted."""
+        with memory_storage._get_connection() as conn:
+            try:
+                conn.execute("DELETE FROM line_items WHERE id = 1")
+                assert False, "Delete should have been prevented"
+            except Exception as e:
+                assert "cannot be deleted" in str(e)
+
+    def test_no_update_line_item(self, memory_storage):
+        """Test that line items cannot be modified."""
+        with memory_storage._get_connection() as conn:
+            try:
+                conn.execute("UPDATE line_items SET debit_cents = 99999 WHERE id = 1")
+                assert False, "Update should have been prevented"
+            except Exception as e:
+                assert "cannot be modified" in str(e)
+        assert memory_storage.get_by_id(1).line_items[0].debit == D50
 
 
 def test_get_trial_balance(storage):
     """Test trial balance calculation."""
     create_accounts(storage, "assets:cash", "income:revenue", "expenses:food", "expenses:utilities")
-    storage.add(make_entry("Salary", "assets:cash", "income:revenue", "1000.00"))
-    storage.add(make_entry("Groceries", "expenses:food", "assets:cash", "50.00"))
-    storage.add(make_entry("Utilities", "expenses:utilities", "assets:cash", "100.00"))
-
-    balance = storage.get_trial_balance()
-
-    assert balance["assets:cash"]["debits"] == Decimal("1000")
-    assert balance["assets:cash"]["credits"] == Decimal("150")
-    assert balance["assets:cash"]["net"] == Decimal("850")
+    storage.add_many([
+        make_entry("Salary", "assets:cash", "income:revenue", D1000),
+        make_entry("Groceries", "expenses:food", "assets:cash", D50),
+        make_entry("Utilities", "expenses:utilities", "assets:cash", D100),
+    ])
 
-    assert balance["expenses:food"]["debits"] == Decimal("50")
-    assert balance["expenses:food"]["credits"] == Decimal("0")
-    assert balance["expenses:food"]["net"] == Decimal("50")
-
-    assert balance["expenses:utilities"]["debits"] == Decimal("100")
-    assert balance["expenses:utilities"]["credits"] == Decimal("0")
-    assert balance["expenses:utilities"]["net"] == Decimal("100")
-
-    assert balance["income:revenue"]["debits"] == Decimal("0")
-    assert balance["income:revenue"]["credits"] == Decimal("1000")
-    assert balance["income:revenue"]["net"] == Decimal("-1000")
+    zero = Decimal("0")
+    assert storage.get_trial_balance() == {
+        "assets:cash": {"debits": D1000, "credits": Decimal("150"), "net": Decimal("850")},
+        "expenses:food": {"debits": D50, "credits": zero, "net": D50},
+        "expenses:utilities": {"debits": D100, "credits": zero, "net": D100},
+        "income:revenue": {"debits": zero, "credits": D1000, "net": Decimal("-1000")},
+    }
 
 
 def test_trial_balance_scoped(storage):
     """Test trial balance scoped to an account subtree."""
     create_accounts(storage, "assets:cash", "income:revenue", "expenses:food")
-    storage.add(make_entry("Salary", "assets:cash", "income:revenue", "1000.00"))
-    storage.add(make_entry("Groceries", "expenses:food", "assets:cash", "50.00"))
+    storage.add_many([
+        make_entry("Salary", "assets:cash", "income:revenue", D1000),
+        make_entry("Groceries", "expenses:food", "assets:cash", D50),
+    ])
 
     balance = storage.get_trial_balance(account="expenses")
     assert "expenses:food" in balance
@@ -206,13 +286,13 @@ def test_trial_balance_empty(storage):
 def test_trial_balance_debits_equal_credits(storage):
     """Test that total debits always equal total credits."""
     create_accounts(storage, "assets:cash", "income:revenue", "expenses:food")
-    storage.add(make_entry("Salary", "assets:cash", "income:revenue", "1000.00"))
-    storage.add(make_entry("Groceries", "expenses:food", "assets:cash", "50.00"))
+    storage.add_many([
+        make_entry("Salary", "assets:cash", "income:revenue", D1000),
+        make_entry("Groceries", "expenses:food", "assets:cash", D50),
+    ])
 
-    balance = storage.get_trial_balance()
-    total_debits = sum(v["debits"] for v in balance.values())
-    total_credits = sum(v["credits"] for v in balance.values())
-    assert total_debits == total_credits
+    total_debits, total_credits = storage.get_trial_balance_totals()
+    assert total_debits == total_credits == Decimal("1050")
 
 
 def test_database_not_initialized_error(tmp_path):
@@ -222,16 +302,179 @@ def test_database_not_initialized_error(tmp_path):
         TransactionStorage(db_path)
     assert "not found" in str(exc_info.value)
     assert str(db_path) in str(exc_info.value)
+    assert not db_path.exists()
+
+
+def test_unopenable_database_is_not_reported_missing(tmp_path):
+    """Test that a path that exists but can't be opened says why."""
+    with pytest.raises(DatabaseOpenError) as exc_info:
+        TransactionStorage(tmp_path)
+    assert "not found" not in str(exc_info.value)
+    assert str(tmp_path) in str(exc_info.value)
+
+
+def test_open_path_with_uri_characters(tmp_path):
+    """Test that paths needing URI escaping open the existing database."""
+    db_path = tmp_path / "my ledger?#%.bozo"
+    TransactionStorage.init_database(db_path).close()
+    with TransactionStorage(str(db_path)) as storage:
+        assert storage.get_accounts() == []
 
 
 def test_init_database(tmp_path):
     """Test initializing a new database."""
     db_path = tmp_path / "ledger.bozo"
-    storage = TransactionStorage.init_database(db_path)
-    assert db_path.exists()
-    create_accounts(storage, "assets:cash", "income:revenue")
-    storage.add(make_entry())
-    assert len(storage.get_all()) == 1
+    with TransactionStorage.init_database(db_path) as storage:
+        assert db_path.exists()
+        create_accounts(storage, "assets:cash", "income:revenue")
+        storage.add(make_entry())
+        assert len(storage.get_all()) == 1
+
+
+# Schema and writes of releases before schema versioning, as in their
+# TransactionStorage._init_db() and add().
+V0_SCHEMA = """
+    CREATE TABLE journal_entries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        description TEXT NOT NULL,
+        timestamp TEXT NOT NULL
+    );
+    CREATE TABLE line_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        journal_entry_id INTEGER NOT NULL REFERENCES journal_entries(id),
+        account TEXT NOT NULL,
+        debit TEXT,
+        credit TEXT,
+        CHECK (
+            (debit IS NOT NULL AND credit IS NULL) OR
+            (debit IS NULL AND credit IS NOT NULL)
+        )
+    );
+    CREATE TABLE accounts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        type TEXT NOT NULL CHECK (type IN ('asset','liability','income','expense','capital','drawings')),
+        parent_id INTEGER REFERENCES accounts(id)
+    );
+    CREATE TRIGGER prevent_journal_entry_update BEFORE UPDATE ON journal_entries
+    BEGIN SELECT RAISE(ABORT, 'Journal entries cannot be modified'); END;
+    CREATE TRIGGER prevent_journal_entry_delete BEFORE DELETE ON journal_entries
+    BEGIN SELECT RAISE(ABORT, 'Journal entries cannot be deleted'); END;
+    CREATE TRIGGER prevent_line_item_update BEFORE UPDATE ON line_items
+    BEGIN SELECT RAISE(ABORT, 'Line items cannot be modified'); END;
+    CREATE TRIGGER prevent_line_item_delete BEFORE DELETE ON line_items
+    BEGIN SELECT RAISE(ABORT, 'Line items cannot be deleted'); END;
+    INSERT INTO accounts (name, type, parent_id) VALUES
+        ('assets', 'asset', NULL), ('assets:cash', 'asset', 1), ('income', 'income', NULL);
+"""
+
+
+def create_v0_database(path, *entries):
+    """Helper to write entries into a ledger the way releases before schema versioning did."""
+    conn = sqlite3.connect(path)
+    conn.executescript(V0_SCHEMA)
+    for entry in entries:
+        entry_id = conn.execute(
+            "INSERT INTO journal_entries (description, timestamp) VALUES (?, ?)",
+            (entry.description, entry.timestamp.isoformat()),
+        ).lastrowid
+        for item in entry.line_items:
+            conn.execute(
+                "INSERT INTO line_items (journal_entry_id, account, debit, credit) VALUES (?, ?, ?, ?)",
+                (
+                    entry_id,
+                    item.account.lower(),
+                    str(item.debit) if item.debit is not None else None,
+                    str(item.credit) if item.credit is not None else None,
+                ),
+            )
+    conn.commit()
+    conn.close()
+
+
+def v0_entries(amount=D50):
+    """Helper to build the entries the v0 ledger tests record."""
+    bonus = make_entry("Bonus", "assets:cash", "income", amount)
+    bonus.timestamp = datetime(2024, 2, 1, 9, 0, 0, 250000)
+    return make_entry("Salary", "assets:cash", "income", Decimal("1E+1")), bonus
+
+
+def test_v0_database_upgraded_on_open(tmp_path):
+    """Test that a ledger from before schema versioning is converted in place."""
+    db_path = tmp_path / "old.bozo"
+    create_v0_database(db_path, *v0_entries())
+    with TransactionStorage(db_path) as storage:
+        salary, bonus = sorted(storage.get_all(), key=lambda e: e.id)
+        assert salary.timestamp == TS
+        assert bonus.timestamp == datetime(2024, 2, 1, 9, 0, 0, 250000)
+        assert [item.debit for item in salary.line_items] == [D10, None]
+        assert bonus.line_items[0].debit == D50
+        assert storage.get_trial_balance_totals() == (Decimal("60.00"), Decimal("60.00"))
+        assert len(storage.get_by_account("assets")) == 2
+        assert storage.add(make_entry(credit_acct="income")) == 3
+        conn = storage._get_connection()
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == 1
+        with pytest.raises(sqlite3.IntegrityError):
+            conn.execute("DELETE FROM line_items WHERE id = 1")
+    with TransactionStorage(db_path) as storage:
+        assert len(storage.get_all()) == 3
+
+
+def test_v0_sub_cent_amount_names_entry_and_remedy(tmp_path):
+    """Test that a sub-cent amount stops the upgrade, saying where and what to run."""
+    db_path = tmp_path / "old.bozo"
+    create_v0_database(db_path, *v0_entries(Decimal("12.345")))
+    with pytest.raises(IncompatibleDatabaseError) as exc_info:
+        TransactionStorage(db_path)
+    message = str(exc_info.value)
+    assert "entry #2 has amount 12.345" in message
+    assert "bozo upgrade --round" in message
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT debit FROM line_items WHERE id = 3").fetchone() == ("12.345",)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 0
+    conn.close()
+
+
+@pytest.mark.parametrize("rounding, expected", [
+    (ROUND_HALF_UP, Decimal("12.35")),
+    (ROUND_HALF_EVEN, Decimal("12.34")),
+    (ROUND_DOWN, Decimal("12.34")),
+])
+def test_v0_sub_cent_amounts_rounded_on_request(tmp_path, rounding, expected):
+    """Test that a chosen rounding mode lets the upgrade convert sub-cent amounts."""
+    db_path = tmp_path / "old.bozo"
+    create_v0_database(db_path, *v0_entries(Decimal("12.345")))
+    with TransactionStorage(db_path, rounding=rounding) as storage:
+        bonus = storage.get_by_id(2)
+        assert [bonus.line_items[0].debit, bonus.line_items[1].credit] == [expected, expected]
+        assert storage.get_trial_balance_totals() == (D10 + expected, D10 + expected)
+
+
+def test_database_from_newer_version_refused(schema_template, tmp_path):
+    """Test that a schema version we don't know is not touched."""
+    db_path = tmp_path / "new.bozo"
+    shutil.copyfile(schema_template, db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA user_version = 99")
+    conn.close()
+    with pytest.raises(IncompatibleDatabaseError, match=NEWER_VERSION_RE):
+        TransactionStorage(db_path)
+
+
+def test_non_ledger_database_refused(tmp_path):
+    """Test that an SQLite file without a ledger in it is refused."""
+    db_path = tmp_path / "other.bozo"
+    sqlite3.connect(db_path).execute("CREATE TABLE t (x)").connection.close()
+    with pytest.raises(IncompatibleDatabaseError, match=NOT_A_LEDGER_RE):
+        TransactionStorage(db_path)
+
+
+def test_non_database_file_refused(tmp_path):
+    """Test that a file that isn't SQLite is reported, not raised as sqlite3's error."""
+    db_path = tmp_path / "notes.bozo"
+    db_path.write_text("not a database\n" * 100)
+    with pytest.raises(DatabaseOpenError):
+        TransactionStorage(db_path)
 
 
 def test_create_account_creates_ancestor_chain(storage):
@@ -247,20 +490,20 @@ def test_create_account_creates_ancestor_chain(storage):
 def test_create_account_duplicate_raises(storage):
     """Test that creating an already-existing account raises ValueError."""
     storage.create_account("assets:cash")
-    with pytest.raises(ValueError, match="already exists"):
+    with pytest.raises(ValueError, match=ALREADY_EXISTS_RE):
         storage.create_account("assets:cash")
 
 
 def test_record_unknown_account_raises(storage):
     """Test that recording with an unknown non-root account raises ValueError."""
-    with pytest.raises(ValueError, match="does not exist"):
-        storage.add(make_entry("Bad", "expenses:foood", "assets:cash", "10.00"))
+    with pytest.raises(ValueError, match=DOES_NOT_EXIST_RE):
+        storage.add(make_entry("Bad", "expenses:foood", "assets:cash", D10))
 
 
 def test_root_accounts_auto_created_during_transaction(storage):
     """Test that root accounts are still auto-created during transactions."""
     create_accounts(storage, "assets:cash", "income:revenue")
-    storage.add(make_entry("Test", "assets:cash", "income:revenue", "100.00"))
+    storage.add(make_entry("Test", "assets:cash", "income:revenue", D100))
     accounts = storage.get_accounts()
     names = [a.name for a in accounts]
     # Root accounts should exist (auto-created or via create_account ancestors)
@@ -271,7 +514,7 @@ def test_root_accounts_auto_created_during_transaction(storage):
 def test_account_hierarchy_parent_ids(storage):
     """Test that parent_id is set correctly in account hierarchy."""
     create_accounts(storage, "assets:bank:checking", "income:revenue")
-    storage.add(make_entry("Test", "assets:bank:checking", "income:revenue", "100.00"))
+    storage.add(make_entry("Test", "assets:bank:checking", "income:revenue", D100))
     accounts = storage.get_accounts()
     by_name = {a.name: a for a in accounts}
 
@@ -280,10 +523,20 @@ def test_account_hierarchy_parent_ids(storage):
     assert by_name["assets:bank:checking"].parent_id == by_name["assets:bank"].id
 
 
+def test_create_account_extends_existing_chain(storage):
+    """Test that new descendants link to an existing parent and are cached."""
+    storage.create_account("assets:bank")
+    storage.create_account("assets:bank:savings:holiday")
+    by_name = {a.name: a for a in storage.get_accounts()}
+    assert by_name["assets:bank:savings"].parent_id == by_name["assets:bank"].id
+    assert by_name["assets:bank:savings:holiday"].parent_id == by_name["assets:bank:savings"].id
+    assert storage._account_ids["assets:bank:savings:holiday"] == by_name["assets:bank:savings:holiday"].id
+
+
 def test_account_types(storage):
     """Test that account types are inferred from root segment."""
     create_accounts(storage, "assets:cash", "liabilities:loan")
-    storage.add(make_entry("Test", "assets:cash", "liabilities:loan", "100.00"))
+    storage.add(make_entry("Test", "assets:cash", "liabilities:loan", D100))
     accounts = storage.get_accounts()
     by_name = {a.name: a for a in accounts}
 
@@ -296,7 +549,7 @@ def test_account_types(storage):
 def test_get_accounts_filtered_by_type(storage):
     """Test filtering accounts by type."""
     create_accounts(storage, "assets:cash", "income:revenue")
-    storage.add(make_entry("Test", "assets:cash", "income:revenue", "100.00"))
+    storage.add(make_entry("Test", "assets:cash", "income:revenue", D100))
     asset_accounts = storage.get_accounts(account_type="asset")
     assert all(a.type == "asset" for a in asset_accounts)
     assert len(asset_accounts) == 2  # assets, assets:cash
@@ -304,16 +557,420 @@ def test_get_accounts_filtered_by_type(storage):
 
 def test_invalid_root_rejected(storage):
     """Test that invalid account roots are rejected."""
-    with pytest.raises(ValueError, match="Invalid account root"):
-        storage.add(make_entry("Bad", "badroot:foo", "assets:cash", "100.00"))
+    with pytest.raises(ValueError, match=INVALID_ROOT_RE):
+        storage.add(make_entry("Bad", "badroot:foo", "assets:cash", D100))
 
 
 def test_account_names_lowercased(storage):
     """Test that account names are stored lowercase."""
     storage.create_account("Assets:Cash")
     storage.create_account("Income:Revenue")
-    storage.add(make_entry("Test", "Assets:Cash", "Income:Revenue", "100.00"))
+    storage.add(make_entry("Test", "Assets:Cash", "Income:Revenue", D100))
     accounts = storage.get_accounts()
     names = [a.name for a in accounts]
     assert "assets:cash" in names
     assert "income:revenue" in names
+
+
+def test_get_trial_balance_totals(storage):
+    """Test that trial balance totals are summed in storage."""
+    create_accounts(storage, "assets:cash", "income:revenue", "expenses:food")
+    storage.add_many([
+        make_entry("Salary", "assets:cash", "income:revenue", D1000),
+        make_entry("Groceries", "expenses:food", "assets:cash", D50),
+    ])
+
+    assert storage.get_trial_balance_totals() == (Decimal("1050"), Decimal("1050"))
+    assert storage.get_trial_balance_totals(account="expenses") == (D50, Decimal("0"))
+
+
+def test_get_trial_balance_with_totals(storage):
+    """Test that balances and totals read together match the separate calls."""
+    create_accounts(storage, "assets:cash", "income:revenue", "expenses:food")
+    storage.add_many([
+        make_entry("Salary", "assets:cash", "income:revenue", D1000),
+        make_entry("Groceries", "expenses:food", "assets:cash", D50),
+    ])
+    for scope in (None, "assets", "expenses:food", "liabilities"):
+        accounts, totals = storage.get_trial_balance_with_totals(account=scope)
+        assert accounts == storage.get_trial_balance(account=scope)
+        assert totals == storage.get_trial_balance_totals(account=scope)
+
+
+def test_trial_balance_totals_beyond_integer_range(storage):
+    """Test that totals past SQLite's integer range are still exact."""
+    create_accounts(storage, "assets:cash", "assets:bank", "income:revenue", "income:gifts")
+    amount = Decimal("90000000000000000")
+    storage.add_many([
+        make_entry("Cash", "assets:cash", "income:revenue", amount),
+        make_entry("Bank", "assets:bank", "income:gifts", amount),
+    ])
+    assert storage.get_trial_balance_totals() == (2 * amount, 2 * amount)
+    assert storage.get_trial_balance_totals(account="assets") == (2 * amount, 0)
+
+
+def test_get_trial_balance_totals_empty(storage):
+    """Test trial balance totals with no entries."""
+    assert storage.get_trial_balance_totals() == (Decimal("0"), Decimal("0"))
+
+
+def test_iter_all_is_lazy(storage):
+    """Test that iter_all yields entries one at a time."""
+    create_accounts(storage, "assets:cash", "income:revenue")
+    storage.add_many([
+        make_entry("First"),
+        make_entry("Second"),
+    ])
+    entries = storage.iter_all()
+    assert not isinstance(entries, list)
+    assert len(list(entries)) == 2
+
+
+def test_iter_by_account(storage):
+    """Test that iter_by_account matches get_by_account."""
+    create_accounts(storage, "assets:cash", "income:revenue", "expenses:food")
+    storage.add_many([
+        make_entry("Salary", "assets:cash", "income:revenue", D1000),
+        make_entry("Groceries", "expenses:food", "assets:cash", D30),
+    ])
+    descriptions = [e.description for e in storage.iter_by_account("expenses")]
+    assert descriptions == ["Groceries"]
+
+
+def test_failed_add_rolls_back(storage):
+    """Test that a rejected entry leaves no partial rows behind."""
+    create_accounts(storage, "assets:cash")
+    with pytest.raises(ValueError):
+        storage.add(make_entry("Bad", "assets:cash", "expenses:missing", D10))
+    assert storage.get_all() == []
+    assert "expenses" not in [a.name for a in storage.get_accounts()]
+
+
+def test_connection_pragmas(storage):
+    """Test that tuned PRAGMAs are applied to the connection."""
+    conn = storage._get_connection()
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2  # MEMORY
+
+
+def test_disk_storage_uses_wal(disk_storage):
+    """Test that new database files, including the test template, use WAL."""
+    conn = disk_storage._get_connection()
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+
+
+def test_init_database_without_wal(tmp_path):
+    """Test that WAL can be disabled for network filesystems."""
+    with TransactionStorage.init_database(tmp_path / "nfs.bozo", wal=False) as storage:
+        mode = storage._get_connection().execute("PRAGMA journal_mode").fetchone()[0]
+    assert mode == "delete"
+
+
+def test_add_many(storage):
+    """Test recording several entries in one transaction."""
+    create_accounts(storage, "assets:cash", "income:revenue", "expenses:food")
+    ids = storage.add_many([
+        make_entry("Salary", "assets:cash", "income:revenue", D1000),
+        make_entry("Groceries", "expenses:food", "assets:cash", D30),
+    ])
+    assert ids == [1, 2]
+    assert storage.get_by_id(2).description == "Groceries"
+    assert len(storage.get_by_id(2).line_items) == 2
+
+
+def test_add_many_is_atomic(storage):
+    """Test that one bad entry rejects the whole batch."""
+    create_accounts(storage, "assets:cash", "income:revenue")
+    with pytest.raises(ValueError, match=DOES_NOT_EXIST_RE):
+        storage.add_many([
+            make_entry("Salary", "assets:cash", "income:revenue", D1000),
+            make_entry("Bad", "expenses:foood", "assets:cash", D10),
+        ])
+    assert storage.get_all() == []
+
+
+def test_add_many_deferring_indexes(storage):
+    """Test that a bulk load without the account index rebuilds it."""
+    create_accounts(storage, "assets:cash", "income:revenue")
+    storage.add_many([make_entry(f"Entry {i}") for i in range(3)], defer_indexes=True)
+    assert len(storage.get_by_account("assets")) == 3
+    indexes = {row[0] for row in storage._get_connection().execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index'"
+    )}
+    assert "idx_line_items_account" in indexes
+
+
+def test_add_many_deferring_indexes_rolls_back(storage):
+    """Test that a failed bulk load leaves the account index in place."""
+    create_accounts(storage, "assets:cash", "income:revenue")
+    with pytest.raises(ValueError):
+        storage.add_many([make_entry("Bad", "expenses:foood")], defer_indexes=True)
+    assert storage._get_connection().execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'idx_line_items_account'"
+    ).fetchone() is not None
+
+
+def test_line_items_loaded_by_index(storage):
+    """Test that joining line items onto entries uses the journal_entry_id index."""
+    plan = storage._get_connection().execute(
+        "EXPLAIN QUERY PLAN " + _ENTRY_BY_ID_QUERY, (1,)
+    ).fetchall()
+    assert any("idx_line_items_journal_entry_id" in row[-1] for row in plan)
+
+
+def test_amounts_stored_as_integer_cents(storage):
+    """Test that amounts are stored as INTEGER cents."""
+    create_accounts(storage, "assets:cash", "income:revenue")
+    storage.add(make_entry(amount=Decimal("12.34")))
+    row = storage._get_connection().execute(
+        "SELECT debit_cents, typeof(debit_cents) FROM line_items WHERE debit_cents IS NOT NULL"
+    ).fetchone()
+    assert tuple(row) == (1234, "integer")
+    assert storage.get_by_id(1).line_items[0].debit == Decimal("12.34")
+
+
+@pytest.mark.parametrize("amount", ["0.00", "7.00", "10.00", "10.01", "1000.00"])
+def test_amounts_read_back_with_two_places(storage, amount):
+    """Test that cached and computed amounts both keep two decimal places."""
+    create_accounts(storage, "assets:cash", "income:revenue")
+    storage.add(make_entry(amount=Decimal(amount)))
+    assert str(storage.get_by_id(1).line_items[0].debit) == amount
+
+
+def test_sub_cent_amount_rejected(storage):
+    """Test that amounts with fractions of a cent are rejected."""
+    create_accounts(storage, "assets:cash", "income:revenue")
+    with pytest.raises(ValueError, match=SUB_CENT_RE):
+        storage.add(make_entry(amount=Decimal("1.005")))
+    assert storage.get_all() == []
+
+
+def test_amount_beyond_integer_range_rejected(storage):
+    """Test that an amount too large for an integer column is a ValueError."""
+    create_accounts(storage, "assets:cash", "income:revenue")
+    with pytest.raises(ValueError, match=TOO_LARGE_RE):
+        storage.add(make_entry(amount=Decimal(2**63) / 100))
+    assert storage.get_all() == []
+
+
+def test_balance_overflow_rejected(storage):
+    """Test that a running balance past the integer range is refused."""
+    create_accounts(storage, "assets:cash", "income:revenue")
+    storage.add(make_entry(amount=Decimal("90000000000000000")))
+    with pytest.raises(ValueError, match=BALANCE_OUT_OF_RANGE_RE):
+        storage.add(make_entry(amount=Decimal("10000000000000000")))
+    assert len(storage.get_all()) == 1
+    assert storage.get_trial_balance()["assets:cash"]["debits"] == Decimal("90000000000000000")
+
+
+def test_trial_balance_exact_beyond_float_precision(storage):
+    """Test that trial balance sums don't lose cents to floating point."""
+    create_accounts(storage, "assets:cash", "income:revenue")
+    storage.add_many([
+        make_entry("Big", "assets:cash", "income:revenue", Decimal("9876543210987654.32")),
+        make_entry("Small", "assets:cash", "income:revenue", Decimal("0.01")),
+    ])
+
+    balance = storage.get_trial_balance()
+    assert balance["assets:cash"]["debits"] == Decimal("9876543210987654.33")
+    assert balance["income:revenue"]["net"] == Decimal("-9876543210987654.33")
+    assert storage.get_trial_balance_totals() == (
+        Decimal("9876543210987654.33"),
+        Decimal("9876543210987654.33"),
+    )
+
+
+def test_account_lookups_cached_across_adds(storage):
+    """Test that repeat adds resolve known accounts without querying them."""
+    create_accounts(storage, "assets:cash", "income:revenue")
+    storage.add(make_entry())
+    statements = []
+    storage._get_connection().set_trace_callback(statements.append)
+    storage.add(make_entry())
+    assert not [s for s in statements if "FROM accounts" in s]
+
+
+def test_account_ids_not_cached_after_rollback(storage):
+    """Test that ids from a rolled-back transaction are not cached."""
+    with pytest.raises(RuntimeError):
+        with storage._transaction() as conn:
+            conn.execute("INSERT INTO accounts (name, type) VALUES ('assets', 'asset')")
+            storage._lookup_accounts(conn, ["assets"])
+            raise RuntimeError("abort")
+    assert storage._account_ids == {}
+    assert storage.get_accounts() == []
+
+
+def test_lowercased_account_names_are_shared():
+    """Test that repeated lowercasing returns the same string object, from a bounded cache."""
+    first = _lower("Assets:" + "Cash")
+    assert first == "assets:cash"
+    assert _lower("Assets:" + "Cash") is first
+    assert _lower.cache_info().maxsize is not None
+
+
+def test_get_by_account_prefix_is_literal(storage):
+    """Test that wildcard characters in an account filter match literally."""
+    create_accounts(storage, "expenses:a_b:food", "expenses:axb:food", "assets:cash")
+    storage.add_many([
+        make_entry("Literal", "expenses:a_b:food", "assets:cash", Decimal("1.00")),
+        make_entry("Other", "expenses:axb:food", "assets:cash", Decimal("1.00")),
+    ])
+    assert [e.description for e in storage.get_by_account("expenses:a_b")] == ["Literal"]
+    assert storage.get_by_account("expenses:*") == []
+
+
+def test_account_filter_uses_index(storage):
+    """Test that the subtree filter can use the account index."""
+    plan = storage._get_connection().execute(
+        "EXPLAIN QUERY PLAN " + _SUBTREE_ENTRY_QUERY, ("assets", "assets:", "assets;")
+    ).fetchall()
+    assert any("idx_line_items_account" in row[-1] for row in plan)
+
+
+def test_context_manager_closes_connections(schema_template):
+    """Test that leaving a with block closes the storage's connections."""
+    with TransactionStorage(schema_template) as storage:
+        storage.get_accounts()
+    with pytest.raises(sqlite3.ProgrammingError):
+        storage._get_connection().execute("SELECT 1")
+    assert storage._readers.empty()
+
+
+def test_readers_are_pooled(disk_storage):
+    """Test that read connections are returned to the pool and reused."""
+    with disk_storage._reader() as first:
+        pass
+    with disk_storage._reader() as second:
+        assert second is first
+        assert second is not disk_storage._get_connection()
+
+
+def test_concurrent_readers(disk_storage):
+    """Test that reads from several threads each get a connection."""
+    create_accounts(disk_storage, "assets:cash", "income:revenue")
+    disk_storage.add(make_entry())
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: len(disk_storage.get_all()), range(32)))
+    assert results == [1] * 32
+    assert disk_storage._readers.qsize() <= 4
+
+
+def test_concurrent_writers(disk_storage):
+    """Test that adds from several threads are each committed once."""
+    create_accounts(disk_storage, "assets:cash", "income:revenue")
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        entry_ids = list(pool.map(lambda i: disk_storage.add(make_entry(f"Entry {i}")), range(200)))
+    assert sorted(entry_ids) == list(range(1, 201))
+    assert len(disk_storage.get_all()) == 200
+
+
+def test_reader_open_failure_is_storage_error(disk_storage):
+    """Test that a reader that can't be opened raises a StorageError, not sqlite3's."""
+    for path in disk_storage.db_path.parent.glob(disk_storage.db_path.name + "*"):
+        path.unlink()
+    with pytest.raises(DatabaseNotInitializedError):
+        disk_storage.get_all()
+
+
+def test_memory_database_reads_through_shared_connection():
+    """Test that an in-memory database is read on its only connection."""
+    with TransactionStorage.init_database(":memory:") as storage:
+        create_accounts(storage, "assets:cash", "income:revenue")
+        storage.add(make_entry())
+        with storage._reader() as conn:
+            assert conn is storage._get_connection()
+        assert len(storage.get_all()) == 1
+
+
+def test_account_balances_track_line_items(storage):
+    """Test that the balances table matches sums over the line items."""
+    create_accounts(storage, "assets:cash", "income:revenue", "expenses:food")
+    storage.add_many([
+        make_entry("Salary", "assets:cash", "income:revenue", D1000),
+        make_entry("Groceries", "expenses:food", "assets:cash", D30),
+    ])
+    storage.add(make_entry("More groceries", "expenses:food", "assets:cash", D25))
+    conn = storage._get_connection()
+    balances = conn.execute(
+        "SELECT account, debit_cents, credit_cents FROM account_balances ORDER BY account"
+    ).fetchall()
+    sums = conn.execute("""
+        SELECT account, COALESCE(SUM(debit_cents), 0), COALESCE(SUM(credit_cents), 0)
+        FROM line_items GROUP BY account ORDER BY account
+    """).fetchall()
+    assert balances == sums
+    assert ("assets:cash", 100000, 5500) in balances
+
+
+def test_scoped_trial_balance_searches_balances(storage):
+    """Test that a scoped trial balance is a key lookup on account_balances."""
+    plan = [row[-1] for row in storage._get_connection().execute(
+        "EXPLAIN QUERY PLAN " + _SUBTREE_BALANCE_QUERY, ("assets", "assets:", "assets;")
+    )]
+    assert any(step.startswith("SEARCH account_balances") for step in plan)
+
+
+def test_missing_lookups_skip_entry_queries(storage):
+    """Test that ids past the last entry and unknown accounts are not queried."""
+    create_accounts(storage, "assets:cash", "assets:bank-old", "income:revenue")
+    storage.add(make_entry())
+    storage.get_by_id(1)
+    storage.get_by_account("assets")
+    statements = []
+    storage._get_connection().set_trace_callback(statements.append)
+    assert storage.get_by_id(2) is None
+    assert storage.get_by_account("expenses") == []
+    assert storage.get_by_account("assets:bank") == []
+    assert not [s for s in statements if "journal_entries" in s or "line_items" in s]
+    assert len(storage.get_by_account("assets")) == 1
+
+
+def test_lookup_caches_follow_new_entries_and_accounts(storage):
+    """Test that entries and accounts added after caching are found."""
+    create_accounts(storage, "assets:cash", "income:revenue")
+    assert storage.get_by_id(1) is None
+    assert storage.get_by_account("expenses") == []
+    storage.create_account("expenses:food")
+    storage.add(make_entry("Groceries", "expenses:food", "assets:cash"))
+    assert storage.get_by_id(1).description == "Groceries"
+    assert len(storage.get_by_account("expenses")) == 1
+
+
+def test_lookup_caches_see_other_connections(disk_storage):
+    """Test that writes through another storage invalidate the caches."""
+    assert disk_storage.get_by_id(1) is None
+    assert disk_storage.get_by_account("assets") == []
+    with TransactionStorage(disk_storage.db_path) as other:
+        create_accounts(other, "assets:cash", "income:revenue")
+        other.add(make_entry())
+    assert disk_storage.get_by_id(1) is not None
+    assert len(disk_storage.get_by_account("assets")) == 1
+
+
+def test_lookup_caches_match_stored_account_names(storage):
+    """Test that an account is found as its line items spell it."""
+    create_accounts(storage, "assets:cash", "income:revenue")
+    storage.add(make_entry(debit_acct=" Assets:Cash "))
+    assert len(storage.get_by_account(" assets:cash ")) == 1
+
+
+def test_lookups_read_through_readers(disk_storage):
+    """Test that cached lookups are filled without the writer connection."""
+    create_accounts(disk_storage, "assets:cash", "income:revenue")
+    disk_storage.add(make_entry())
+    statements = []
+    disk_storage._get_connection().set_trace_callback(statements.append)
+    assert disk_storage.get_by_id(1) is not None
+    assert len(disk_storage.get_by_account("assets")) == 1
+    assert statements == []
+
+
+def test_accounts_by_type_use_index(storage):
+    """Test that listing one account type is an index search with no sort."""
+    plan = [row[-1] for row in storage._get_connection().execute(
+        "EXPLAIN QUERY PLAN " + _ACCOUNTS_BY_TYPE_QUERY, ("asset",)
+    )]
+    assert any("idx_accounts_type_name" in step for step in plan)
+    assert not any("TEMP B-TREE" in step for step in plan)
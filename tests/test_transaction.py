@@ -1,5 +1,6 @@
 """Tests for transaction module."""
 
+import re
 from datetime import datetime
 from decimal import Decimal
 
@@ -7,6 +8,11 @@ import pytest
 
 from bozo.transaction import Account, JournalEntry, LineItem, parse_account_path
 
+TS = datetime(2024, 1, 15, 10, 30)
+
+INVALID_ROOT_RE = re.compile("Invalid account root")
+INVALID_NAME_RE = re.compile("Invalid account name")
+
 
 def test_line_item_debit():
     """Test creating a debit line item."""
@@ -28,7 +34,7 @@ def test_journal_entry_creation():
     """Test creating a journal entry with line items."""
     entry = JournalEntry(
         description="Salary",
-        timestamp=datetime(2024, 1, 15, 10, 30),
+        timestamp=TS,
         line_items=[
             LineItem(account="assets:cash", debit=Decimal("1000.00")),
             LineItem(account="income:revenue", credit=Decimal("1000.00")),
@@ -44,7 +50,7 @@ def test_journal_entry_default_line_items():
     """Test that line_items defaults to empty list."""
     entry = JournalEntry(
         description="Empty",
-        timestamp=datetime(2024, 1, 1),
+        timestamp=TS,
     )
     assert entry.line_items == []
 
@@ -53,21 +59,21 @@ def test_parse_account_path_simple():
     """Test parsing a single-segment account."""
     acct_type, segments = parse_account_path("assets")
     assert acct_type == "asset"
-    assert segments == ["assets"]
+    assert segments == ("assets",)
 
 
 def test_parse_account_path_nested():
     """Test parsing a multi-segment account."""
     acct_type, segments = parse_account_path("assets:bank:checking")
     assert acct_type == "asset"
-    assert segments == ["assets", "bank", "checking"]
+    assert segments == ("assets", "bank", "checking")
 
 
 def test_parse_account_path_case_insensitive():
     """Test that account paths are lowercased."""
     acct_type, segments = parse_account_path("Assets:Bank")
     assert acct_type == "asset"
-    assert segments == ["assets", "bank"]
+    assert segments == ("assets", "bank")
 
 
 def test_parse_account_path_all_types():
@@ -87,13 +93,13 @@ def test_parse_account_path_all_types():
 
 def test_parse_account_path_invalid_root():
     """Test that invalid root segments raise ValueError."""
-    with pytest.raises(ValueError, match="Invalid account root"):
+    with pytest.raises(ValueError, match=INVALID_ROOT_RE):
         parse_account_path("badroot:foo")
 
 
 def test_parse_account_path_empty():
     """Test that empty account name raises ValueError."""
-    with pytest.raises(ValueError, match="Invalid account name"):
+    with pytest.raises(ValueError, match=INVALID_NAME_RE):
         parse_account_path("")
 
 
@@ -106,6 +112,15 @@ def test_account_dataclass():
     assert acct.id == 2
 
 
+def test_models_use_slots():
+    """Test that model instances carry no per-instance __dict__."""
+    item = LineItem(account="assets:cash", debit=Decimal("1.00"))
+    entry = JournalEntry(description="Slots", timestamp=TS, line_items=[item])
+    acct = Account(name="assets", type="asset")
+    for obj in (item, entry, acct):
+        assert not hasattr(obj, "__dict__")
+
+
 def test_account_defaults():
     """Test Account dataclass defaults."""
     acct = Account(name="assets", type="asset")